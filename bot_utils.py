@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+bot_utils.py
+
+Helpers shared by the bots in this repository: batched file counts for
+categories, maxlag-aware saving and the prefix-trie regex used to match
+template aliases.
+"""
+
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pywikibot
+from pywikibot.exceptions import MaxlagTimeoutError, OtherPageSaveError
+
+
+CATEGORYINFO_BATCH_SIZE = 50  # Titles per prop=categoryinfo request (API limit)
+CATEGORYINFO_WORKERS = 4  # categoryinfo batches fetched in parallel
+SAVE_MAX_RETRIES = 8  # Retries for a save rejected because the servers are lagged
+SAVE_BACKOFF_BASE = 2.0  # Seconds before the first retry; grows 1.5x per attempt
+
+
+def trie_regex(names: List[str]) -> str:
+    """
+    Build a regex alternation over names with shared prefixes factored out.
+
+    ['CatDiffuse', 'Cat diffuse', 'Category diffuse'] becomes
+    'cat(?:\\ diffuse|diffuse|egory\\ diffuse)', so the engine tests each
+    common prefix once instead of once per name. Names are lowercased, so
+    the pattern either runs on lowercased text or is compiled with
+    re.IGNORECASE.
+
+    Args:
+        names: Literal strings to match
+
+    Returns:
+        Regex source matching exactly one of the names
+    """
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}  # End of a name
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' not in node:
+            return body
+        return f'(?:{body})?' if len(branches) == 1 else body + '?'
+
+    return emit(trie)
+
+
+def fetch_categoryinfo_batch(site: pywikibot.site.BaseSite, titles: List[str]) -> Dict[str, int]:
+    """
+    Fetch file counts for up to CATEGORYINFO_BATCH_SIZE categories in one request.
+
+    Args:
+        site: Site to query
+        titles: Category titles to look up
+
+    Returns:
+        Dict mapping category title to number of files (empty if the request failed)
+    """
+    try:
+        data = site.simple_request(
+            action='query',
+            prop='categoryinfo',
+            titles='|'.join(titles)
+        ).submit()
+    except Exception as e:
+        logging.warning("Error fetching categoryinfo for %d categories: %s", len(titles), e)
+        return {}
+
+    # Categories without any members have no categoryinfo entry
+    return {
+        page['title']: page.get('categoryinfo', {}).get('files', 0)
+        for page in data.get('query', {}).get('pages', {}).values()
+    }
+
+
+def bulk_file_counts(
+    site: pywikibot.site.BaseSite,
+    categories: List[pywikibot.Page],
+    max_workers: int = CATEGORYINFO_WORKERS
+) -> Dict[str, int]:
+    """
+    Fetch exact file counts for many categories using batched categoryinfo queries.
+
+    One API request covers up to CATEGORYINFO_BATCH_SIZE titles, and up to
+    max_workers requests are in flight at once. Categories in a batch that
+    fails are left out of the result so callers can fall back to counting
+    members for them.
+
+    Args:
+        site: Site to query
+        categories: Category pages to count files in
+        max_workers: Number of batches fetched concurrently
+
+    Returns:
+        Dict mapping category title to number of files
+    """
+    titles = [category.title() for category in categories]
+    batches = [
+        titles[start:start + CATEGORYINFO_BATCH_SIZE]
+        for start in range(0, len(titles), CATEGORYINFO_BATCH_SIZE)
+    ]
+    counts = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_counts in executor.map(lambda batch: fetch_categoryinfo_batch(site, batch), batches):
+            counts.update(batch_counts)
+    return counts
+
+
+def save_with_backoff(
+    page: pywikibot.Page,
+    summary: str,
+    max_retries: int = SAVE_MAX_RETRIES,
+    base: float = SAVE_BACKOFF_BASE,
+    **kwargs
+) -> None:
+    """
+    Save a page, retrying with exponential backoff while the servers are lagged.
+
+    Pywikibot already sends maxlag with every write; this adds a retry budget
+    on top for saves that still fail on maxlag or HTTP 429.
+
+    Args:
+        page: Page with the new text already set
+        summary: Edit summary
+        max_retries: Number of retries before giving up
+        base: Seconds to wait before the first retry
+        **kwargs: Passed through to page.save() (e.g. minor, basetimestamp)
+
+    Raises:
+        MaxlagTimeoutError, OtherPageSaveError: When retries are exhausted or
+            the save failed for a reason other than server lag
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            page.save(summary=summary, **kwargs)
+            return
+        except (MaxlagTimeoutError, OtherPageSaveError) as e:
+            # Only the reason: the full message embeds the page title
+            message = str(getattr(e, 'reason', e)).lower()
+            lagged = isinstance(e, MaxlagTimeoutError) or 'maxlag' in message or '429' in message
+            if not lagged or attempt == max_retries:
+                raise
+            wait = base * (1.5 ** attempt)
+            logging.warning("Server lagged saving %s, retrying in %.1fs", page.title(), wait)
+            time.sleep(wait)
@@ -9,14 +9,25 @@ Usage:
   python3 category_diffusion_bot.py                    # Dry-run with default 200 threshold
   python3 category_diffusion_bot.py -live              # Execute removals
   python3 category_diffusion_bot.py -live -min:150     # Execute with 150-file threshold
+  python3 category_diffusion_bot.py --threshold 150    # Same threshold, argparse style
   python3 category_diffusion_bot.py -limit:50          # Process only 50 categories
+  python3 category_diffusion_bot.py -live --state state.json  # Resume an interrupted run
 """
 
 import argparse
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import re
 import sys
+import threading
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Pattern, Tuple
 
 import pywikibot
 from pywikibot.exceptions import (
@@ -26,24 +37,37 @@ from pywikibot.exceptions import (
     OtherPageSaveError,
 )
 
+from bot_utils import bulk_file_counts, save_with_backoff
+
 
 # Configuration
 DIFFUSION_CATEGORY = "Category:Categories requiring temporary diffusion"
 DEFAULT_THRESHOLD = 200
 EDIT_SUMMARY = "Bot: Removing category with <{threshold} files from diffusion list (decluttering)"
+MAX_WORKERS = 8  # Concurrent subcategory workers (reads only; saves are serialized)
+STATE_FLUSH_EVERY = 50  # Processed categories between writes of the --state resume file
+STATE_MAX_AGE = 7 * 24 * 3600  # Seconds before a --state entry is checked again
 
 
 def count_files_in_category(category: pywikibot.Category, threshold: int) -> int:
     """
     Count files in a category, short-circuiting if count exceeds threshold.
     
+    Reads the exact count from categoryinfo in one request; only if that is
+    unavailable does it walk the members, stopping after threshold + 1 files.
+    
     Args:
         category: pywikibot.Category object
         threshold: Maximum count before short-circuit
     
     Returns:
-        Number of files found (capped at threshold + 1)
+        Number of files found (capped at threshold + 1 when walking members)
     """
+    try:
+        return category.categoryinfo.get('files', 0)
+    except Exception as e:
+        logging.debug(f"No categoryinfo for {category.title()}, counting members: {e}")
+    
     count = 0
     try:
         # namespace 6 = File namespace
@@ -56,6 +80,50 @@ def count_files_in_category(category: pywikibot.Category, threshold: int) -> int
     return count
 
 
+def load_state(path: str, max_age: float = STATE_MAX_AGE) -> Dict[str, dict]:
+    """
+    Load the categories an earlier, interrupted run already processed.
+    
+    Entries older than max_age are dropped, since file counts change over
+    time and those categories are worth checking again.
+    
+    Args:
+        path: Path of the JSON state file
+        max_age: Seconds after which an entry expires
+    
+    Returns:
+        Dict mapping category title to {'outcome': ..., 'ts': ...} (empty if
+        the file is missing or unreadable)
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            done = json.load(f)['done']
+        cutoff = time.time() - max_age
+        return {title: entry for title, entry in done.items() if entry['ts'] >= cutoff}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning(f"Ignoring unreadable state file {path}: {e}")
+        return {}
+
+
+def save_state(path: str, done: Dict[str, dict]) -> None:
+    """
+    Write the processed categories to the state file.
+    
+    The file is written next to its final location and renamed over it, so an
+    interruption mid-write never leaves a truncated state file behind.
+    
+    Args:
+        path: Path of the JSON state file
+        done: Category title -> {'outcome': ..., 'ts': ...} for each processed category
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'done': done}, f)
+    os.replace(tmp_path, path)
+
+
 def get_subcategories(parent_category: pywikibot.Category) -> List[pywikibot.Category]:
     """
     Fetch all subcategories from the parent diffusion category.
@@ -76,11 +144,27 @@ def get_subcategories(parent_category: pywikibot.Category) -> List[pywikibot.Cat
     return subcategories
 
 
+def compile_parent_tag_regex(parent_title: str) -> Pattern[str]:
+    """
+    Compile the pattern matching a parent tag, [[Category:Parent]] or [[Category:Parent|Sort]].
+    
+    Args:
+        parent_title: Title of the parent category
+    
+    Returns:
+        Compiled pattern, built once per run and reused for every subcategory
+    """
+    return re.compile(rf'\[\[{re.escape(parent_title)}(?:\|[^\]]*)?\]\]')
+
+
 def remove_category_from_parent(
     category: pywikibot.Category,
     parent_category: pywikibot.Category,
     dry_run: bool,
-    threshold: int
+    threshold: int,
+    save_lock: Optional[threading.Semaphore] = None,
+    *,
+    tag_re: Optional[Pattern[str]] = None
 ) -> bool:
     """
     Remove a category from its parent by removing the parent category tag.
@@ -90,6 +174,8 @@ def remove_category_from_parent(
         parent_category: Parent category (diffusion list)
         dry_run: If True, don't save changes
         threshold: Threshold value for edit summary
+        save_lock: Optional semaphore serializing saves across worker threads
+        tag_re: Precompiled compile_parent_tag_regex() pattern; built here if omitted
     
     Returns:
         True if successful, False otherwise
@@ -98,37 +184,18 @@ def remove_category_from_parent(
         # Get the category page
         page = pywikibot.Page(category.site, category.title())
         text = page.get()
+        # Revision the edit is based on; the API rejects the save if it changed since
+        base_ts = page.latest_revision.timestamp
         
-        # Look for the parent category tag (with or without pipe syntax)
-        import re
-        parent_title = parent_category.title()
-        parent_tag = f"[[{parent_title}]]"
-        parent_tag_with_pipe = f"[[{parent_title}|"
+        # Remove the parent category tag in one pass (handles both [[Cat]] and [[Cat|Sort]] forms)
+        if tag_re is None:
+            tag_re = compile_parent_tag_regex(parent_category.title())
+        new_text, removed = tag_re.subn('', text)
         
-        # Check if parent category is present in any form
-        if parent_tag not in text and parent_tag_with_pipe not in text:
+        if not removed:
             logging.debug(f"{category.title()} doesn't contain parent tag")
             return False
         
-        # Remove the parent category tag (handles both [[Cat]] and [[Cat|Sort]] forms)
-        new_text = text
-        
-        # First try simple replacement
-        if parent_tag in text:
-            new_text = new_text.replace(parent_tag, "")
-        
-        # Then handle pipe syntax with regex
-        pattern = re.escape(parent_title).replace(':', r'\:')
-        new_text = re.sub(
-            rf'\[\[{pattern}\|[^\]]*\]\]',
-            '',
-            new_text
-        )
-        
-        if new_text == text:
-            logging.debug(f"No changes needed for {category.title()}")
-            return False
-        
         if dry_run:
             logging.info(f"[DRY-RUN] Would remove {category.title()} from diffusion list")
             return True
@@ -136,7 +203,20 @@ def remove_category_from_parent(
         # Save the changes
         page.text = new_text
         summary = EDIT_SUMMARY.format(threshold=threshold)
-        page.save(summary=summary, minor=False)
+        with save_lock or nullcontext():
+            try:
+                save_with_backoff(page, summary, minor=False, basetimestamp=base_ts)
+            except EditConflictError:
+                # Someone edited meanwhile: re-apply the removal to their revision once
+                logging.info(f"Edit conflict on {category.title()}, retrying on latest revision")
+                text = page.get(force=True)
+                base_ts = page.latest_revision.timestamp
+                new_text, removed = tag_re.subn('', text)
+                if not removed:
+                    logging.info(f"{category.title()} no longer lists the parent tag")
+                    return False
+                page.text = new_text
+                save_with_backoff(page, summary, minor=False, basetimestamp=base_ts)
         logging.info(f"✓ Removed {category.title()} from diffusion list")
         return True
         
@@ -157,6 +237,49 @@ def remove_category_from_parent(
         return False
 
 
+def process_subcategory(
+    subcat: pywikibot.Category,
+    parent_category: pywikibot.Category,
+    dry_run: bool,
+    threshold: int,
+    save_lock: threading.Semaphore,
+    file_count: Optional[int] = None,
+    tag_re: Optional[Pattern[str]] = None
+) -> Tuple[str, str]:
+    """
+    Remove one subcategory from the diffusion list if it has few enough files.
+    
+    Runs on a worker thread: reads proceed in parallel, while the edit
+    itself is serialized through save_lock.
+    
+    Args:
+        subcat: Subcategory to check
+        parent_category: Parent category (diffusion list)
+        dry_run: If True, don't save changes
+        threshold: Maximum file count for removal
+        save_lock: Semaphore serializing saves across worker threads
+        file_count: Known file count, or None to count the files here
+        tag_re: Precompiled compile_parent_tag_regex() pattern
+    
+    Returns:
+        Tuple of ("removed" | "skipped", category title)
+    """
+    title = subcat.title()
+    if file_count is None:
+        file_count = count_files_in_category(subcat, threshold)
+    
+    if file_count > threshold:
+        logging.info(f"{title}: {file_count} files (>{threshold}) - keeping in list")
+        return "skipped", title
+    
+    logging.info(f"{title}: {file_count} files (≤{threshold}) - removing from list")
+    if not remove_category_from_parent(
+        subcat, parent_category, dry_run, threshold, save_lock=save_lock, tag_re=tag_re
+    ):
+        return "skipped", title
+    return "removed", title
+
+
 def main():
     """Main bot execution."""
     parser = argparse.ArgumentParser(
@@ -168,7 +291,8 @@ def main():
         help='Execute removals (default is dry-run)'
     )
     parser.add_argument(
-        '-min',
+        '-min', '--threshold',
+        dest='min',
         type=int,
         default=DEFAULT_THRESHOLD,
         help=f'Minimum file threshold (default: {DEFAULT_THRESHOLD})'
@@ -183,39 +307,61 @@ def main():
         '-delay',
         type=float,
         default=5.0,
-        help='Seconds to wait between edits (default: 5.0)'
+        help='Minimum seconds between edits (default: 5.0)'
+    )
+    parser.add_argument(
+        '-workers',
+        type=int,
+        default=MAX_WORKERS,
+        help=f'Number of concurrent worker threads (default: {MAX_WORKERS})'
     )
     parser.add_argument(
         '--log',
         default='category_diffusion_bot.log',
         help='Log file path'
     )
+    parser.add_argument(
+        '--state',
+        help='JSON file recording processed categories, used to resume interrupted live runs'
+    )
     
-    args = parser.parse_args()
-    
-    # Handle -min:N format (pywikibot style)
-    for arg in sys.argv[1:]:
-        if arg.startswith('-min:'):
-            args.min = int(arg.split(':')[1])
+    # Accept pywikibot-style -name:value tokens by rewriting them to -name=value
+    argv = [
+        arg.replace(':', '=', 1) if arg.startswith(('-min:', '-limit:', '-delay:', '-workers:')) else arg
+        for arg in sys.argv[1:]
+    ]
+    args = parser.parse_args(argv)
     
     dry_run = not args.live
     threshold = args.min
     
-    # Setup logging
+    # Setup logging: records are queued and written by a background thread
+    log_queue = queue.Queue(-1)
+    file_handler = logging.FileHandler(args.log, delay=True)
+    file_handler.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        file_handler,
+        logging.StreamHandler(sys.stdout),
+        respect_handler_level=True
+    )
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s [%(levelname)s] %(message)s',
-        handlers=[
-            logging.FileHandler(args.log),
-            logging.StreamHandler(sys.stdout)
-        ]
+        handlers=[logging.handlers.QueueHandler(log_queue)]
     )
+    listener.start()
+    atexit.register(listener.stop)  # Flush queued records on exit
     
     mode = "DRY-RUN" if dry_run else "LIVE"
     logging.info(f"=== Category Diffusion Decluttering Bot [{mode}] ===")
     logging.info(f"Threshold: {threshold} files")
     logging.info(f"Target: {DIFFUSION_CATEGORY}")
     
+    # Rate limiting: pywikibot's write throttle only waits out whatever part
+    # of the delay has not already passed while reading and counting
+    pywikibot.config.put_throttle = args.delay
+    
     # Connect to Wikimedia Commons
     site = pywikibot.Site('commons', 'commons')
     site.login()
@@ -223,6 +369,7 @@ def main():
     
     # Get the parent diffusion category
     parent_category = pywikibot.Category(site, DIFFUSION_CATEGORY)
+    tag_re = compile_parent_tag_regex(parent_category.title())
     
     # Fetch all subcategories
     logging.info("Fetching subcategories from diffusion list...")
@@ -233,35 +380,65 @@ def main():
         logging.warning("No subcategories found. Exiting.")
         return
     
-    # Process each subcategory
+    # Skip categories an interrupted earlier run already processed. Removed
+    # ones have left the list anyway; this skips the kept and untagged ones
+    done = {}
+    if args.state:
+        done = load_state(args.state)
+        if done:
+            subcategories = [subcat for subcat in subcategories if subcat.title() not in done]
+            logging.info(f"Resuming: {len(done)} categories already done, {len(subcategories)} left")
+        if not dry_run:
+            atexit.register(lambda: save_state(args.state, done))  # Flush on exit or Ctrl-C
+    
+    def record(title: str, outcome: str) -> None:
+        # Dry-run outcomes did not happen, so a later live run must redo them
+        if args.state and not dry_run:
+            done[title] = {'outcome': outcome, 'ts': time.time()}
+            if len(done) % STATE_FLUSH_EVERY == 0:
+                save_state(args.state, done)
+    
+    if args.limit:
+        subcategories = subcategories[:args.limit]
+        logging.info(f"Processing limit: {args.limit} categories")
+    
     processed = 0
     removed = 0
     skipped = 0
     
-    for i, subcat in enumerate(subcategories, 1):
-        if args.limit and processed >= args.limit:
-            logging.info(f"Reached processing limit ({args.limit})")
-            break
-        
-        logging.info(f"[{i}/{len(subcategories)}] Processing: {subcat.title()}")
-        
-        # Count files in the category
-        file_count = count_files_in_category(subcat, threshold)
-        
-        if file_count <= threshold:
-            logging.info(f"  → {file_count} files (≤{threshold}) - removing from list")
-            
-            if remove_category_from_parent(subcat, parent_category, dry_run, threshold):
+    # Look up file counts in bulk and only queue categories that may need an edit
+    logging.info("Fetching file counts...")
+    file_counts = bulk_file_counts(site, subcategories)
+    candidates = []
+    for subcat in subcategories:
+        file_count = file_counts.get(subcat.title())
+        if file_count is not None and file_count > threshold:
+            logging.info(f"{subcat.title()}: {file_count} files (>{threshold}) - keeping in list")
+            record(subcat.title(), "skipped")
+            skipped += 1
+            processed += 1
+        else:
+            candidates.append((subcat, file_count))
+    logging.info(f"{len(candidates)} categories at or below threshold")
+    
+    # Process candidates concurrently; only one save runs at a time
+    save_lock = threading.Semaphore(1)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(
+            lambda candidate: process_subcategory(
+                candidate[0], parent_category, dry_run, threshold, save_lock,
+                file_count=candidate[1], tag_re=tag_re
+            ),
+            candidates
+        )
+        for i, (outcome, title) in enumerate(results, 1):
+            logging.info(f"[{i}/{len(candidates)}] {title}: {outcome}")
+            record(title, outcome)
+            if outcome == "removed":
                 removed += 1
-                if not dry_run:
-                    time.sleep(args.delay)  # Rate limiting
             else:
                 skipped += 1
-        else:
-            logging.info(f"  → {file_count} files (>{threshold}) - keeping in list")
-            skipped += 1
-        
-        processed += 1
+            processed += 1
     
     # Summary
     logging.info("=" * 60)
@@ -26,6 +26,7 @@ EDIT_SUMMARY_REMOVED_REDUNDANT = 'Bot: Removing redundant {{CatDiffuse}} ({{Diff
 # Bot behavior settings
 DEFAULT_DELAY = 5.0  # Seconds between edits
 DRY_RUN_DEFAULT = True  # Default to dry-run for safety
+MAX_WORKERS = 4  # Pages processed concurrently; saves are still serialized and paced by --delay (put_throttle)
 
 # Logging settings
 LOG_FILE = 'replace_templates.log'
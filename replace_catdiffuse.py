@@ -12,9 +12,15 @@ Usage examples:
 """
 
 import argparse
+import atexit
+import functools
 import logging
-import time
+import logging.handlers
+import queue
+import re
+import threading
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import pywikibot
 import mwparserfromhell
@@ -23,6 +29,10 @@ from pywikibot.exceptions import (
     EditConflictError, LockedPageError, OtherPageSaveError, SpamblacklistError
 )
 
+from bot_utils import (
+    CATEGORYINFO_BATCH_SIZE, CATEGORYINFO_WORKERS, bulk_file_counts, save_with_backoff, trie_regex
+)
+
 # Utility: count files in category, stop early if > threshold
 def count_files_in_category(cat_page, threshold):
     """
@@ -33,10 +43,15 @@ def count_files_in_category(cat_page, threshold):
         threshold: int, maximum count before short-circuit
     
     Returns:
-        int: number of files found (capped at threshold + 1)
+        int: number of files found (capped at threshold + 1 when walking members)
     """
-    count = 0
     cat = pywikibot.Category(cat_page.site, cat_page.title())
+    try:
+        # Exact count in one request; fall back to walking members if unavailable
+        return cat.categoryinfo.get('files', 0)
+    except Exception as e:
+        logging.debug('No categoryinfo for %s, counting members: %s', cat_page.title(), e)
+    count = 0
     gen = cat.members(namespaces=[6], total=threshold + 1)  # namespace 6 = File
     for _ in gen:
         count += 1
@@ -44,10 +59,90 @@ def count_files_in_category(cat_page, threshold):
             break
     return count
 
+@functools.lru_cache(maxsize=1024)
 def normalize_template_name(name):
-    """Normalize template name for comparison (strip spaces, lowercase)."""
+    """
+    Normalize template name for comparison (strip spaces, lowercase).
+
+    Memoized: the cache is process-global and bounded, and holds the few
+    template and parameter names that recur on every page.
+    """
     return name.strip().lower()
 
+@functools.lru_cache(maxsize=32)
+def _source_template_patterns(source_template_names):
+    """
+    Compile the regexes used to find source templates without parsing the page.
+
+    Args:
+        source_template_names: tuple of str, template names to replace
+
+    Returns:
+        tuple: (probe, simple) where probe matches wherever one of the templates may start,
+               and simple matches a whole template whose parameters contain no nested markup
+    """
+    names = trie_regex([n.strip() for n in source_template_names])
+    head = r'\{\{\s*(?:template:\s*)?(?:' + names + r')\s*'
+    probe = re.compile(head + r'[|}<]', re.IGNORECASE)
+    simple = re.compile(head + r'((?:\|[^{}\[\]<>|\n]*)*)\}\}', re.IGNORECASE)
+    return probe, simple
+
+def _replace_simple_templates(page_text, probe, simple, target_template_name, threshold_value, preserve_params):
+    """
+    Rewrite source templates with plain string operations, bypassing mwparserfromhell.
+
+    Only handles pages where every source template has flat, unpadded parameters with
+    unique non-numeric names, so the output is identical to what the parser would produce.
+
+    Returns:
+        tuple: same as find_and_replace_templates, or None if the page needs the parser
+    """
+    parts = []
+    cursor = 0
+    detected_threshold = None
+    for hit in probe.finditer(page_text):
+        m = simple.match(page_text, hit.start())
+        if not m or m.start() < cursor:
+            return None
+
+        params = m.group(1).split('|')[1:]
+        seen = set()
+        has_threshold = False
+        existing_threshold = None
+        for param in params:
+            name, eq, value = param.partition('=')
+            if not eq:
+                if param != param.strip():
+                    return None
+                continue
+            if not name or name != name.strip() or value != value.strip() or name.isdigit() or name in seen:
+                return None
+            seen.add(name)
+            if name.lower() == 'threshold':
+                has_threshold = True
+                try:
+                    existing_threshold = int(value)
+                    detected_threshold = existing_threshold
+                except ValueError:
+                    pass
+
+        final_threshold = existing_threshold if existing_threshold is not None else threshold_value
+        if not preserve_params:
+            params, has_threshold = [], False
+        if not has_threshold:
+            params.append(f'threshold={final_threshold}')
+        parts.append(page_text[cursor:m.start()])
+        parts.append('{{' + target_template_name + ''.join('|' + p for p in params) + '}}')
+        cursor = m.end()
+
+    parts.append(page_text[cursor:])
+    changed = len(parts) > 1
+    return ''.join(parts), changed, detected_threshold
+
+def _param_map(tpl):
+    """Map each normalized parameter name of a template to its last Parameter."""
+    return {normalize_template_name(str(p.name)): p for p in tpl.params}
+
 def find_and_replace_templates(page_text, source_template_names, target_template_name, threshold_value, preserve_params=True):
     """
     Parse text with mwparserfromhell. Replace occurrences of any template in source_template_names
@@ -64,6 +159,17 @@ def find_and_replace_templates(page_text, source_template_names, target_template
         tuple: (new_text, changed, detected_threshold) where detected_threshold is the value
                found in the original template (or None if not present)
     """
+    probe, simple = _source_template_patterns(tuple(source_template_names))
+    if not probe.search(page_text):
+        return page_text, False, None
+
+    # comments, nowiki/pre tags and {{{arguments}}} change what counts as a template
+    if '<' not in page_text and '{{{' not in page_text:
+        result = _replace_simple_templates(page_text, probe, simple, target_template_name,
+                                           threshold_value, preserve_params)
+        if result is not None:
+            return result
+
     parsed = mwparserfromhell.parse(page_text)
     changed = False
     detected_threshold = None
@@ -78,15 +184,14 @@ def find_and_replace_templates(page_text, source_template_names, target_template
 
         if tpl_name in src_normal:
             # Check if template already has a threshold parameter
+            params = _param_map(tpl)
             existing_threshold = None
-            for p in tpl.params:
-                param_name = str(p.name).strip().lower()
-                if param_name == 'threshold':
-                    try:
-                        existing_threshold = int(str(p.value).strip())
-                        detected_threshold = existing_threshold
-                    except (ValueError, TypeError):
-                        pass
+            if 'threshold' in params:
+                try:
+                    existing_threshold = int(str(params['threshold'].value).strip())
+                    detected_threshold = existing_threshold
+                except (ValueError, TypeError):
+                    pass
             
             # Use existing threshold if found, otherwise use default
             final_threshold = existing_threshold if existing_threshold is not None else threshold_value
@@ -97,15 +202,16 @@ def find_and_replace_templates(page_text, source_template_names, target_template
                 # copy all params from old template to new template
                 for p in tpl.params:
                     new_tpl.add(p.name, p.value)
-            # ensure threshold parameter exists (only add if not present)
-            if 'threshold' not in (str(p.name).strip().lower() for p in new_tpl.params):
+            # ensure threshold parameter exists (only add if not copied over above)
+            if not (preserve_params and 'threshold' in params):
                 new_tpl.add('threshold', str(final_threshold))
 
             # replace the old template node with the new one
             parsed.replace(tpl, new_tpl)
             changed = True
 
-    return str(parsed), changed, detected_threshold
+    # only serialize the tree if a template was actually replaced
+    return (str(parsed) if changed else page_text), changed, detected_threshold
 
 def main():
     parser = argparse.ArgumentParser(description='Replace CatDiffuse templates with Diffusion by condition based on file counts.')
@@ -114,96 +220,178 @@ def main():
     parser.add_argument('--threshold', type=int, default=200, help='File count threshold (default 200)')
     parser.add_argument('--dry-run', action='store_true', help='Do not save changes; just show what would be changed')
     parser.add_argument('--limit', type=int, default=0, help='Limit number of categories to process (0 = no limit)')
-    parser.add_argument('--delay', type=float, default=5.0, help='Seconds to wait between edits')
+    parser.add_argument('--delay', type=float, default=5.0, help='Minimum seconds between edits')
     parser.add_argument('--site', default='commons', help='Site family code used by pywikibot (default: commons)')
     parser.add_argument('--summary', default=None, help='Edit summary (default auto-generated)')
     parser.add_argument('--log', default='replace_catdiffuse.log', help='Log file path')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent worker threads (saves are still serialized)')
     args = parser.parse_args()
 
-    # Setup logging
+    # Setup logging: records are queued and written to file/stdout by a background thread
+    log_queue = queue.Queue(-1)
+    file_handler = logging.FileHandler(args.log, delay=True)
+    file_handler.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, logging.StreamHandler(sys.stdout),
+                                              respect_handler_level=True)
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s %(levelname)s: %(message)s',
-        handlers=[
-            logging.FileHandler(args.log),
-            logging.StreamHandler(sys.stdout)
-        ]
+        handlers=[logging.handlers.QueueHandler(log_queue)]
     )
+    listener.start()
+    atexit.register(listener.stop)  # flush queued records on exit
 
+    # pywikibot's write throttle only waits out the part of the delay not already spent reading
+    pywikibot.config.put_throttle = args.delay
     site = pywikibot.Site(args.site, args.site)  # family, lang both set to args.site often works for commons
     site.login()  # ensure logged in (will prompt if necessary)
     logging.info('Logged in as %s on %s', site.user(), site)
 
     source_templates = [t.strip() for t in args.templates.split(',') if t.strip()]
     target_template = args.target
+    # case-insensitive prefilter for a source template call; the same cached pattern
+    # find_and_replace_templates probes with, so no lowercased copy of the page is made
+    source_probe, _ = _source_template_patterns(tuple(source_templates))
 
     processed = 0
     total_candidates = 0
+    # Serializes saves and guards the processed counter shared by the workers
+    save_lock = threading.Semaphore(1)
 
-    # For each source template, get categories that embed it (namespace=14)
-    for src in source_templates:
-        tpl_page = pywikibot.Page(site, 'Template:' + src)
-        logging.info('Searching categories embedding Template:%s ...', src)
-        # embeddedin returns pages that embed the template; filter to namespace 14 (Category)
-        try:
-            gen = tpl_page.embeddedin(namespaces=[14])
-        except Exception as e:
-            logging.exception('Failed to get embeddedin for Template:%s: %s', src, e)
-            continue
-
-        for cat_page in gen:
-            total_candidates += 1
-            if args.limit and processed >= args.limit:
-                logging.info('Reached processing limit (%d)', args.limit)
-                break
-
-            title = cat_page.title()
+    def collect_candidates():
+        """Map each embedding category title to (page, source templates it was found through)."""
+        nonlocal total_candidates
+        candidates = {}
+        # For each source template, get categories that embed it (namespace=14)
+        for src in source_templates:
+            tpl_page = pywikibot.Page(site, 'Template:' + src)
+            logging.info('Searching categories embedding Template:%s ...', src)
+            # embeddedin returns pages that embed the template; filter to namespace 14 (Category)
             try:
-                text = cat_page.get()
+                gen = tpl_page.embeddedin(namespaces=[14])
             except Exception as e:
-                logging.warning('Could not get page %s: %s', title, e)
+                logging.exception('Failed to get embeddedin for Template:%s: %s', src, e)
                 continue
 
-            # quick check for presence of source template text to skip parsing if not present
-            if all(s.lower() not in text.lower() for s in source_templates):
-                continue
+            for cat_page in gen:
+                total_candidates += 1
+                title = cat_page.title()
+                if title in candidates:
+                    # already queued via another variant; one visit rewrites them all
+                    candidates[title][1].append(src)
+                else:
+                    candidates[title] = (cat_page, [src])
+        return candidates
 
-            # Count files (namespace 6). Short-circuit if > threshold.
+    def process_category_page(cat_page, srcs, file_count):
+        """Replace the template in one candidate category that is small enough."""
+        nonlocal processed
+        if args.limit and processed >= args.limit:
+            return
+
+        title = cat_page.title()
+        try:
+            text = cat_page.text  # already loaded by PreloadingGenerator
+            # revision the edit is based on; the API rejects the save if it changed since
+            base_ts = cat_page.latest_revision.timestamp
+        except Exception as e:
+            logging.warning('Could not get page %s: %s', title, e)
+            return
+
+        # quick check for a source template call to skip counting and parsing if not present
+        if not source_probe.search(text):
+            return
+
+        # Count files (namespace 6) if the bulk lookup missed this category
+        if file_count is None:
             file_count = count_files_in_category(cat_page, args.threshold)
-            logging.info('Category %s has %d files (threshold=%d)', title, file_count, args.threshold)
-
-            if file_count <= args.threshold:
-                new_text, changed, detected_threshold = find_and_replace_templates(text, [src], target_template, args.threshold)
-                if changed:
-                    # Use detected threshold from template if found, otherwise CLI default
-                    used_threshold = detected_threshold if detected_threshold is not None else args.threshold
-                    logging.info('Would replace in %s (using threshold=%d)', title, used_threshold)
-                    if args.dry_run:
-                        logging.info('[dry-run] %s would be saved (files=%d, threshold=%d)', title, file_count, used_threshold)
-                    else:
-                        # Save changes
-                        page = pywikibot.Page(site, title)
-                        used_threshold = detected_threshold if detected_threshold is not None else args.threshold
-                        edit_summary = args.summary or f'Bot: Replace {src} with {target_template} (threshold={used_threshold})'
-                        try:
-                            page.text = new_text
-                            page.save(summary=edit_summary)
-                            logging.info('Saved %s', title)
-                        except (EditConflictError, LockedPageError, SpamblacklistError, OtherPageSaveError) as e:
-                            logging.warning('Could not save %s: %s', title, e)
-                        except Exception as e:
-                            logging.exception('Unexpected error while saving %s: %s', title, e)
-
-                        time.sleep(args.delay)
-
-                    processed += 1
-                else:
-                    logging.info('No matching template instance found in %s', title)
-            else:
+            if file_count > args.threshold:
                 logging.debug('Category %s skipped (files=%d > threshold=%d)', title, file_count, args.threshold)
+                return
 
-        if args.limit and processed >= args.limit:
-            break
+        new_text, changed, detected_threshold = find_and_replace_templates(text, source_templates, target_template, args.threshold)
+        if not changed:
+            logging.info('No matching template instance found in %s', title)
+            return
+
+        # Use detected threshold from template if found, otherwise CLI default
+        used_threshold = detected_threshold if detected_threshold is not None else args.threshold
+        with save_lock:
+            if args.limit and processed >= args.limit:
+                return
+            logging.info('Would replace in %s (using threshold=%d)', title, used_threshold)
+            if args.dry_run:
+                logging.info('[dry-run] %s would be saved (files=%d, threshold=%d)', title, file_count, used_threshold)
+            else:
+                # Save changes
+                edit_summary = args.summary or f'Bot: Replace {", ".join(srcs)} with {target_template} (threshold={used_threshold})'
+                try:
+                    cat_page.text = new_text
+                    try:
+                        save_with_backoff(cat_page, edit_summary, basetimestamp=base_ts)
+                    except EditConflictError:
+                        # someone edited meanwhile: re-apply the replacement to their revision once
+                        logging.info('Edit conflict on %s, retrying on latest revision', title)
+                        text = cat_page.get(force=True)
+                        base_ts = cat_page.latest_revision.timestamp
+                        new_text, changed, _ = find_and_replace_templates(text, source_templates, target_template, used_threshold)
+                        if not changed:
+                            logging.info('Template already gone from %s', title)
+                            return
+                        cat_page.text = new_text
+                        save_with_backoff(cat_page, edit_summary, basetimestamp=base_ts)
+                    logging.info('Saved %s', title)
+                except (EditConflictError, LockedPageError, SpamblacklistError, OtherPageSaveError) as e:
+                    logging.warning('Could not save %s: %s', title, e)
+                except Exception as e:
+                    logging.exception('Unexpected error while saving %s: %s', title, e)
+
+            processed += 1
+
+    candidates = collect_candidates()
+    logging.info('Found %d unique categories (%d template embeddings)', len(candidates), total_candidates)
+
+    def prepare(batch):
+        """Count files for a batch of candidates and preload the texts of the small ones."""
+        file_counts = bulk_file_counts(site, [cat_page for cat_page, _ in batch])
+        small_candidates = {}
+        for cat_page, srcs in batch:
+            title = cat_page.title()
+            file_count = file_counts.get(title)
+            if file_count is not None:
+                logging.info('Category %s has %d files (threshold=%d)', title, file_count, args.threshold)
+                if file_count > args.threshold:
+                    logging.debug('Category %s skipped (files=%d > threshold=%d)', title, file_count, args.threshold)
+                    continue
+            small_candidates[title] = (srcs, file_count)
+        preloaded = pagegenerators.PreloadingGenerator(
+            (cat_page for cat_page, _ in batch if cat_page.title() in small_candidates), groupsize=50)
+        return [(cat_page, *small_candidates[cat_page.title()]) for cat_page in preloaded]
+
+    # Work through the candidates in batches, reading the next batch (file counts, then
+    # texts) on a separate thread while the current one is parsed and saved. Without
+    # --limit a batch spans several concurrent categoryinfo requests; with --limit it is
+    # 50 titles and nothing is read ahead, so the limit bounds how many categories are
+    # looked up. Parsing runs concurrently, saves go through save_lock
+    titles = list(candidates)
+    batch_size = 50 if args.limit else CATEGORYINFO_BATCH_SIZE * CATEGORYINFO_WORKERS
+    batches = [[candidates[title] for title in titles[start:start + batch_size]]
+               for start in range(0, len(titles), batch_size)]
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(prepare, batches[0]) if batches else None
+        for n in range(len(batches)):
+            ready = pending.result() if pending else prepare(batches[n])
+            pending = None
+            if not args.limit and n + 1 < len(batches):
+                pending = reader.submit(prepare, batches[n + 1])
+            futures = [executor.submit(process_category_page, *item) for item in ready]
+            for future in futures:
+                future.result()
+            if args.limit and processed >= args.limit:
+                break
+
+    if args.limit and processed >= args.limit:
+        logging.info('Reached processing limit (%d)', args.limit)
 
     logging.info('Done. Processed %d categories (candidates seen: %d)', processed, total_candidates)
 
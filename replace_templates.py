@@ -24,14 +24,19 @@ Usage:
 """
 
 import argparse
+import functools
 import logging
 import re
 import sys
-import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from itertools import chain, islice
 from typing import List, Tuple, Optional
 
 import pywikibot
 from pywikibot import pagegenerators
+from pywikibot.tools.itertools import filter_unique
 from pywikibot.exceptions import (
     EditConflictError,
     LockedPageError,
@@ -39,9 +44,22 @@ from pywikibot.exceptions import (
     OtherPageSaveError,
 )
 
+from bot_utils import trie_regex
 import config
 
 
+# Cleanup patterns applied after templates are removed: _BLANK collapses blank
+# lines, _CLEANUP also collapses runs of spaces in the same scan
+_BLANK = re.compile(r'\n\n+')
+_CLEANUP = re.compile(r'(\n\n+)|( {2,})')
+
+
+def _cleanup_sub(match: re.Match) -> str:
+    """Replacement for a _CLEANUP match: one blank line or a single space."""
+    return '\n\n' if match.group(1) else ' '
+
+
+@functools.lru_cache(maxsize=1024)
 def normalize_template_name(name: str) -> str:
     """
     Normalize template name for case-insensitive comparison.
@@ -52,10 +70,38 @@ def normalize_template_name(name: str) -> str:
     Returns:
         Lowercase, stripped template name
     """
-    # Remove namespace prefix if present
-    if ':' in name:
-        name = name.split(':', 1)[1]
-    return name.strip().lower().replace('_', ' ')
+    # Remove namespace prefix if present. Results are memoized in a small
+    # process-global cache, since the same few names recur on every page
+    return name.split(':', 1)[-1].strip().lower().replace('_', ' ')
+
+
+@functools.lru_cache(maxsize=128)
+def _build_source_regex(source_templates: Tuple[str, ...], flags: int) -> re.Pattern:
+    """lru_cached backend of build_source_regex, keyed on the tuple of template names and flags."""
+    return re.compile(
+        r'\{\{\s*(' + trie_regex(list(source_templates)) + r')\s*(\|[^\}]*)?\}\}',
+        flags
+    )
+
+
+def build_source_regex(source_templates: List[str], ignorecase: bool = True) -> re.Pattern:
+    """
+    Build one pattern matching a call to any of the source templates.
+    
+    Group 1 is the template name as written and group 2 its parameters.
+    Patterns are cached, so repeated calls with the same names are cheap.
+    One scan covers every name; a generic {{...}} tokenizer that looks each
+    name up in a set is much slower, as it stops at every template on the page.
+    
+    Args:
+        source_templates: Source template names
+        ignorecase: Match any case; if False, the pattern only matches
+            lowercased text, which lets the regex engine skip case folding
+    
+    Returns:
+        Compiled alternation over all source templates
+    """
+    return _build_source_regex(tuple(source_templates), re.IGNORECASE if ignorecase else 0)
 
 
 def extract_limit_from_template(text: str, template_name: str) -> Optional[int]:
@@ -69,37 +115,63 @@ def extract_limit_from_template(text: str, template_name: str) -> Optional[int]:
     Returns:
         Integer limit if found, None otherwise
     """
-    # Pattern to match {{TemplateName|limit}} or {{TemplateName|150}}
-    normalized_name = normalize_template_name(template_name)
+    start = text.find('{{')
+    if start == -1:
+        return None
+    end = text.find('}}', start)
+    body = text[start + 2:] if end == -1 else text[start + 2:end]
     
-    # Try to find numbered parameter: {{Template|150}}
-    pattern = r'\{\{\s*' + re.escape(template_name) + r'\s*\|\s*(\d+)\s*\}\}'
-    match = re.search(pattern, text, re.IGNORECASE)
-    if match:
-        return int(match.group(1))
+    name, bar, params = body.partition('|')
+    if not bar or name.strip().lower() != template_name.lower():
+        return None
     
-    # Try to find named parameter: {{Template|limit=150}}
-    pattern = r'\{\{\s*' + re.escape(template_name) + r'\s*\|\s*limit\s*=\s*(\d+)'
-    match = re.search(pattern, text, re.IGNORECASE)
-    if match:
-        return int(match.group(1))
+    # Numbered parameter: {{Template|150}}
+    value = params.strip()
+    if end != -1 and value.isdecimal():
+        return int(value)
+    
+    # Named parameter: {{Template|limit=150}}
+    key, eq, value = params.partition('=')
+    if eq and key.strip().lower() == 'limit':
+        value = value.lstrip()
+        digits = 0
+        while digits < len(value) and value[digits].isdecimal():
+            digits += 1
+        if digits:
+            return int(value[:digits])
     
     return None
 
 
-def has_target_template(text: str, target: str) -> bool:
+def has_target_template(text: str, target: str, text_lower: Optional[str] = None) -> bool:
     """
     Check if text already contains the target template.
     
     Args:
         text: Wikitext to search
         target: Target template name
+        text_lower: text.lower(), if the caller already has it
     
     Returns:
         True if target template found
     """
-    pattern = r'\{\{\s*' + re.escape(target) + r'\s*[\|\}]'
-    return bool(re.search(pattern, text, re.IGNORECASE))
+    # Plain substring scan: each hit on the name must be preceded by "{{" and
+    # followed by "|" or "}", with optional whitespace in between
+    if text_lower is None:
+        text_lower = text.lower()
+    needle = target.lower()
+    pos = text_lower.find(needle)
+    while pos != -1:
+        before = pos
+        while before > 0 and text_lower[before - 1].isspace():
+            before -= 1
+        after = pos + len(needle)
+        while after < len(text_lower) and text_lower[after].isspace():
+            after += 1
+        if before >= 2 and text_lower.startswith('{{', before - 2) and text_lower[after:after + 1] in ('|', '}'):
+            return True
+        pos = text_lower.find(needle, pos + 1)
+    return False
 
 
 def replace_templates(
@@ -107,7 +179,7 @@ def replace_templates(
     source_templates: List[str],
     target_template: str,
     default_limit: int
-) -> Tuple[str, bool, str]:
+) -> Tuple[str, bool, str, Optional[int]]:
     """
     Replace source templates with target template, handling duplicates and limits.
     
@@ -123,73 +195,77 @@ def replace_templates(
         default_limit: Default limit value if not specified
     
     Returns:
-        Tuple of (new_text, changed, action_description)
+        Tuple of (new_text, changed, action_description, limit), where limit is
+        the value written into the target template (None if none was written)
     """
-    original_text = text
-    changed = False
-    action = ""
+    # Most pages mention none of the templates: a substring test rules them out
+    # before any regex runs, and only names that do occur go into the pattern
+    text_lower = text.lower()
+    present = [source for source in source_templates if source.lower() in text_lower]
+    if not present:
+        return text, False, "No source templates found", None
     
     # Check if target template already exists
-    target_exists = has_target_template(text, target_template)
+    target_exists = has_target_template(text, target_template, text_lower)
     
-    # Find all source templates
-    source_found = []
-    for source in source_templates:
-        pattern = r'\{\{\s*' + re.escape(source) + r'\s*(\|[^\}]*)?\}\}'
-        matches = list(re.finditer(pattern, text, re.IGNORECASE))
-        if matches:
-            source_found.extend([(source, m) for m in matches])
+    # Match on the lowercased copy so the pattern needs no case folding, and
+    # copy from the original text at the same offsets. A few characters
+    # (e.g. 'İ') change length when lowercased; such pages use IGNORECASE
+    if len(text_lower) == len(text):
+        matches = build_source_regex(present, ignorecase=False).finditer(text_lower)
+    else:
+        matches = build_source_regex(present).finditer(text)
     
-    if not source_found:
-        return text, False, "No source templates found"
+    # Rewrite every source template in a single pass: the first becomes the
+    # target (unless it already exists), the rest are dropped. The kept
+    # slices and the replacement are joined into the new text once at the end
+    parts = []
+    cursor = 0
+    found = 0
+    replaced = None  # (name as written, limit) of the template turned into the target
+    for match in matches:
+        parts.append(text[cursor:match.start()])
+        cursor = match.end()
+        found += 1
+        if target_exists or replaced:
+            continue
+        # Extract custom limit from first template
+        name = text[match.start(1):match.end(1)]
+        custom_limit = extract_limit_from_template(text[match.start():cursor], name)
+        limit = custom_limit if custom_limit else default_limit
+        replaced = (name, limit)
+        parts.append(f'{{{{{target_template}|{limit}}}}}')
     
-    # Sort by position in text
-    source_found.sort(key=lambda x: x[1].start())
+    if not found:
+        return text, False, "No source templates found", None
+    parts.append(text[cursor:])
+    text = ''.join(parts)
     
     if target_exists:
-        # Target already exists - just remove all source templates
-        # Remove from end to start to avoid position shifting issues
-        for source, match in reversed(source_found):
-            text = text[:match.start()] + text[match.end():]
-        
-        # Remove extra blank lines
-        text = re.sub(r'\n\n+', '\n\n', text)
-        # Clean up extra spaces
-        text = re.sub(r'  +', ' ', text)
-        changed = True
-        action = "Removed redundant source templates (target already exists)"
-    else:
-        # Replace first source template, remove rest
-        first_source, first_match = source_found[0]
-        
-        # Extract custom limit from first template
-        custom_limit = extract_limit_from_template(first_match.group(0), first_source)
-        limit = custom_limit if custom_limit else default_limit
-        
-        # Build replacement template
-        replacement = f'{{{{{target_template}|{limit}}}}}'
-        
-        # Replace first occurrence
-        text = text[:first_match.start()] + replacement + text[first_match.end():]
-        offset = len(replacement) - len(first_match.group(0))
-        
-        # Remove remaining source templates
-        for source, match in source_found[1:]:
-            # Adjust position based on previous changes
-            new_start = match.start() + offset if match.start() > first_match.start() else match.start()
-            new_end = match.end() + offset if match.end() > first_match.start() else match.end()
-            
-            text = text[:new_start] + text[new_end:]
-            offset -= (new_end - new_start)
-        
-        # Clean up extra blank lines
-        text = re.sub(r'\n\n+', '\n\n', text)
-        
-        changed = True
-        action = f"Replaced {first_source} with {target_template}|{limit}" + \
-                (f" and removed {len(source_found)-1} duplicate(s)" if len(source_found) > 1 else "")
+        # Clean up extra blank lines and spaces
+        text = _CLEANUP.sub(_cleanup_sub, text)
+        return text, True, "Removed redundant source templates (target already exists)", None
+    
+    # Clean up extra blank lines
+    text = _BLANK.sub('\n\n', text)
     
-    return text, changed, action
+    first_source, limit = replaced
+    # Report the configured name rather than the spelling found on the page
+    first_source = next(
+        (s for s in source_templates
+         if normalize_template_name(s) == normalize_template_name(first_source)),
+        first_source
+    )
+    action = f"Replaced {first_source} with {target_template}|{limit}" + \
+            (f" and removed {found-1} duplicate(s)" if found > 1 else "")
+    return text, True, action, limit
+
+
+class Outcome(IntEnum):
+    """Result of processing one category page."""
+    UNCHANGED = 0  # Nothing to replace
+    UPDATED = 1  # Saved, or would have been saved in dry-run mode
+    FAILED = 2  # Could not be read or saved
 
 
 def process_category(
@@ -199,7 +275,7 @@ def process_category(
     default_limit: int,
     dry_run: bool,
     verbose: bool
-) -> bool:
+) -> Outcome:
     """
     Process a single category page for template replacement.
     
@@ -212,11 +288,12 @@ def process_category(
         verbose: If True, log verbose output
     
     Returns:
-        True if processed successfully
+        Outcome of the page: unchanged, updated or failed
     """
+    title = page.title()
     try:
         text = page.text
-        new_text, changed, action = replace_templates(
+        new_text, changed, action, used_limit = replace_templates(
             text,
             source_templates,
             target_template,
@@ -225,45 +302,63 @@ def process_category(
         
         if not changed:
             if verbose:
-                logging.info(f"No changes needed for {page.title()}")
-            return True
+                logging.info("No changes needed for %s", title)
+            return Outcome.UNCHANGED
         
         if dry_run:
-            logging.info(f"[DRY-RUN] Would update {page.title()}: {action}")
+            logging.info("[DRY-RUN] Would update %s: %s", title, action)
             if verbose:
-                logging.debug(f"Old text:\n{text}\n")
-                logging.debug(f"New text:\n{new_text}\n")
+                logging.debug("Old text:\n%s\n", text)
+                logging.debug("New text:\n%s\n", new_text)
         else:
             # Determine appropriate edit summary
-            if "Removed redundant" in action:
+            if used_limit is None:
                 summary = config.EDIT_SUMMARY_REMOVED_REDUNDANT
             else:
-                # Extract limit from action
-                limit_match = re.search(r'\|(\d+)', action)
-                limit = limit_match.group(1) if limit_match else default_limit
-                summary = config.EDIT_SUMMARY.format(limit=limit)
+                summary = config.EDIT_SUMMARY.format(limit=used_limit)
             
-            page.text = new_text
-            page.save(summary=summary, minor=False, botflag=True)
-            logging.info(f"Updated {page.title()}: {action}")
+            # Submit through the site directly rather than page.save(); keep
+            # the {{bots}}/{{nobots}} opt-out check that save() would do
+            if not page.botMayEdit():
+                raise OtherPageSaveError(
+                    page, 'Editing restricted by {{bots}} or {{nobots}} template'
+                )
+            if not page.site.editpage(page, summary=summary, minor=False, bot=True, text=new_text):
+                raise OtherPageSaveError(page, 'edit was not saved')
+            logging.info("Updated %s: %s", title, action)
         
-        return True
+        return Outcome.UPDATED
         
     except NoPageError:
-        logging.warning(f"Page not found: {page.title()}")
-        return False
+        logging.warning("Page not found: %s", title)
+        return Outcome.FAILED
     except LockedPageError:
-        logging.warning(f"Page is locked: {page.title()}")
-        return False
+        logging.warning("Page is locked: %s", title)
+        return Outcome.FAILED
     except EditConflictError:
-        logging.warning(f"Edit conflict on: {page.title()}")
-        return False
+        logging.warning("Edit conflict on: %s", title)
+        return Outcome.FAILED
     except OtherPageSaveError as e:
-        logging.error(f"Error saving {page.title()}: {e}")
-        return False
-    except Exception as e:
-        logging.error(f"Unexpected error processing {page.title()}: {e}")
-        return False
+        logging.error("Error saving %s: %s", title, e)
+        return Outcome.FAILED
+
+
+def process_category_safely(page: pywikibot.Page, *args) -> Outcome:
+    """
+    Run process_category, logging unexpected errors instead of stopping the run.
+    
+    Args:
+        page: Category page to process
+        *args: Remaining process_category arguments
+    
+    Returns:
+        Result of process_category, or Outcome.FAILED if it raised
+    """
+    try:
+        return process_category(page, *args)
+    except Exception:
+        logging.exception("Unexpected error processing %s", page.title())
+        return Outcome.FAILED
 
 
 def main():
@@ -299,6 +394,12 @@ def main():
         default=config.DEFAULT_DELAY,
         help=f'Seconds to wait between edits (default: {config.DEFAULT_DELAY})'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=config.MAX_WORKERS,
+        help=f'Pages processed concurrently (default: {config.MAX_WORKERS})'
+    )
     parser.add_argument(
         '--templates',
         type=str,
@@ -330,24 +431,30 @@ def main():
         source_templates = [t.strip() for t in args.templates.split(',')]
     
     mode = "DRY-RUN" if args.dry_run else "LIVE"
-    logging.info(f"=== Template Replacement Bot [{mode}] ===")
-    logging.info(f"Source templates: {', '.join(source_templates)}")
-    logging.info(f"Target template: {config.TARGET_TEMPLATE}")
-    logging.info(f"Default limit: {args.default_limit}")
+    logging.info("=== Template Replacement Bot [%s] ===", mode)
+    logging.info("Source templates: %s", ', '.join(source_templates))
+    logging.info("Target template: %s", config.TARGET_TEMPLATE)
+    logging.info("Default limit: %s", args.default_limit)
+    
+    # pywikibot waits between saves itself; use --delay as that interval
+    pywikibot.config.put_throttle = args.delay
     
     # Connect to Wikimedia Commons
     site = pywikibot.Site(config.WIKI_FAMILY, config.WIKI_LANG)
     site.login()
-    logging.info(f"Logged in as {site.user()} on {site}")
+    logging.info("Logged in as %s on %s", site.user(), site)
     
     # Build page generator
     if args.category:
         # Process specific category
         cat = pywikibot.Category(site, args.category)
         gen = cat.members(namespaces=[14])  # Only category pages
-        logging.info(f"Processing categories in: {args.category}")
+        logging.info("Processing categories in: %s", args.category)
     else:
-        # Process all pages with source templates
+        # Process all pages with source templates. Pages that also carry the
+        # target template are deliberately not excluded: replace_templates
+        # still has to remove their redundant source templates, and fully
+        # migrated pages already drop out of these listings
         generators = []
         for template_name in source_templates:
             template = pywikibot.Page(site, f"Template:{template_name}")
@@ -355,45 +462,48 @@ def main():
             gen = template.embeddedin(namespaces=[14])  # Only category pages
             generators.append(gen)
         
-        # Combine generators
-        from itertools import chain
-        gen = chain(*generators)
-        logging.info(f"Processing all category pages with source templates")
+        # Combine generators; a page using several aliases is listed once per
+        # alias (redirects share transclusions), so drop the repeats
+        gen = filter_unique(chain(*generators))
+        logging.info("Processing all category pages with source templates")
     
-    # Apply limit if specified
+    # Apply limit if specified, before preloading so no extra texts are fetched
     if args.limit > 0:
-        gen = pagegenerators.PreloadingGenerator(gen, groupsize=args.limit)
-        logging.info(f"Processing limit: {args.limit} pages")
+        gen = islice(gen, args.limit)
+        logging.info("Processing limit: %s pages", args.limit)
     
-    # Process pages
-    processed = 0
-    updated = 0
+    # Fetch page texts (content included) in batches instead of one request
+    # per page; page.text then reads the preloaded revision
+    gen = pagegenerators.PreloadingGenerator(
+        gen, groupsize=min(50, args.limit) if args.limit > 0 else 50
+    )
     
-    for page in gen:
-        if args.limit > 0 and processed >= args.limit:
-            break
-        
-        processed += 1
-        success = process_category(
-            page,
-            source_templates,
-            config.TARGET_TEMPLATE,
-            args.default_limit,
-            args.dry_run,
-            args.verbose
-        )
-        
-        if success:
-            updated += 1
-        
-        # Rate limiting
-        if not args.dry_run and processed < (args.limit or float('inf')):
-            time.sleep(args.delay)
+    counts = Counter()
+    
+    # Process pages concurrently, one preload batch at a time, so only about
+    # 50 page texts are held while saves wait on the edit throttle
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for batch in iter(lambda: list(islice(gen, 50)), []):
+            results = executor.map(
+                lambda page: process_category_safely(
+                    page,
+                    source_templates,
+                    config.TARGET_TEMPLATE,
+                    args.default_limit,
+                    args.dry_run,
+                    args.verbose
+                ),
+                batch
+            )
+            for outcome in results:
+                counts[outcome] += 1
     
     # Summary
-    logging.info(f"=== Summary ===")
-    logging.info(f"Pages processed: {processed}")
-    logging.info(f"Pages updated: {updated}")
+    logging.info("=== Summary ===")
+    logging.info("Pages processed: %s", sum(counts.values()))
+    logging.info("Pages updated: %s", counts[Outcome.UPDATED])
+    logging.info("Pages unchanged: %s", counts[Outcome.UNCHANGED])
+    logging.info("Pages failed: %s", counts[Outcome.FAILED])
     if args.dry_run:
         logging.info("DRY-RUN mode - no actual changes made")
 
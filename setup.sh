@@ -61,7 +61,12 @@ echo ""
 
 # Run tests
 echo "✓ Running unit tests..."
-python3 -m pytest tests/test_template_replacement.py -v
+# Run in parallel only if pytest-xdist is installed (it is optional)
+if python3 -c "import xdist" 2>/dev/null; then
+    python3 -m pytest -n auto tests/
+else
+    python3 -m pytest tests/
+fi
 echo ""
 
 # Offer dry-run
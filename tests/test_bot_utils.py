@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+test_bot_utils.py
+
+Unit tests for the helpers in bot_utils.py shared by all bots, with mocked
+pywikibot API: batched file counts, maxlag-aware saving, alias trie regex.
+
+Run from the repository root with: pytest tests/test_bot_utils.py -v
+"""
+
+import re
+
+import pytest
+from unittest.mock import Mock, patch, call
+
+from bot_utils import bulk_file_counts, save_with_backoff, trie_regex
+
+
+class TestTrieRegex:
+    """Test the prefix-trie alternation over template aliases."""
+    
+    def test_factors_shared_prefix(self):
+        assert trie_regex(['CatDiffuse', 'Cat diffuse']) == 'cat(?:\\ diffuse|diffuse)'
+    
+    def test_matches_each_name_only(self):
+        pattern = re.compile('(?:' + trie_regex(['Cat', 'CatDiffuse']) + ')$')
+        assert pattern.match('cat') and pattern.match('catdiffuse')
+        assert not pattern.match('catdif')
+
+
+class TestBulkFileCounts:
+    """Test batched categoryinfo lookups."""
+    
+    @staticmethod
+    def _categories(n):
+        return [Mock(title=Mock(return_value=f"Category:C{i}")) for i in range(n)]
+    
+    def test_reads_file_counts(self):
+        """Test counts are read from the categoryinfo response."""
+        mock_site = Mock()
+        mock_site.simple_request.return_value.submit.return_value = {
+            'query': {'pages': {
+                '1': {'title': 'Category:C0', 'categoryinfo': {'files': 12, 'pages': 3}},
+                '2': {'title': 'Category:C1', 'categoryinfo': {'files': 500}},
+            }}
+        }
+        
+        counts = bulk_file_counts(mock_site, self._categories(2))
+        
+        assert counts == {'Category:C0': 12, 'Category:C1': 500}
+        mock_site.simple_request.assert_called_once_with(
+            action='query', prop='categoryinfo', titles='Category:C0|Category:C1'
+        )
+    
+    def test_empty_category_counts_zero(self):
+        """Test category without categoryinfo entry counts as empty."""
+        mock_site = Mock()
+        mock_site.simple_request.return_value.submit.return_value = {
+            'query': {'pages': {'1': {'title': 'Category:C0'}}}
+        }
+        
+        assert bulk_file_counts(mock_site, self._categories(1)) == {'Category:C0': 0}
+    
+    def test_batches_of_50(self):
+        """Test titles are split into batches of 50 per request."""
+        mock_site = Mock()
+        mock_site.simple_request.return_value.submit.return_value = {}
+        
+        bulk_file_counts(mock_site, self._categories(120))
+        
+        assert mock_site.simple_request.call_count == 3
+    
+    def test_concurrent_batches_are_merged(self):
+        """Test counts from every batch end up in one result."""
+        def request(**kwargs):
+            titles = kwargs['titles'].split('|')
+            pages = {str(i): {'title': t, 'categoryinfo': {'files': len(t)}} for i, t in enumerate(titles)}
+            return Mock(submit=Mock(return_value={'query': {'pages': pages}}))
+        mock_site = Mock()
+        mock_site.simple_request.side_effect = request
+        categories = self._categories(120)
+        
+        counts = bulk_file_counts(mock_site, categories, max_workers=3)
+        
+        assert counts == {c.title(): len(c.title()) for c in categories}
+    
+    def test_failed_batch_is_omitted(self):
+        """Test a failing request leaves its titles out of the result."""
+        mock_site = Mock()
+        mock_site.simple_request.return_value.submit.side_effect = Exception("API Error")
+        
+        assert bulk_file_counts(mock_site, self._categories(3)) == {}
+
+
+class TestSaveWithBackoff:
+    """Test maxlag-aware save retries."""
+    
+    @patch('bot_utils.time.sleep')
+    def test_saves_without_waiting(self, mock_sleep):
+        """Test a healthy save goes through immediately."""
+        mock_page = Mock()
+        
+        save_with_backoff(mock_page, "summary", minor=False)
+        
+        mock_page.save.assert_called_once_with(summary="summary", minor=False)
+        mock_sleep.assert_not_called()
+    
+    @patch('bot_utils.time.sleep')
+    def test_retries_on_maxlag(self, mock_sleep):
+        """Test exponential backoff while the servers are lagged."""
+        from pywikibot.exceptions import MaxlagTimeoutError
+        
+        mock_page = Mock()
+        mock_page.save.side_effect = [MaxlagTimeoutError("lag"), MaxlagTimeoutError("lag"), None]
+        
+        save_with_backoff(mock_page, "summary", base=2.0)
+        
+        assert mock_page.save.call_count == 3
+        assert mock_sleep.call_args_list == [call(2.0), call(3.0)]
+    
+    @patch('bot_utils.time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        """Test the last lag error is raised once retries run out."""
+        from pywikibot.exceptions import MaxlagTimeoutError
+        
+        mock_page = Mock()
+        mock_page.save.side_effect = MaxlagTimeoutError("lag")
+        
+        with pytest.raises(MaxlagTimeoutError):
+            save_with_backoff(mock_page, "summary", max_retries=2)
+        assert mock_page.save.call_count == 3
+    
+    @patch('bot_utils.time.sleep')
+    def test_other_save_error_not_retried(self, mock_sleep):
+        """Test save errors unrelated to lag are raised immediately."""
+        from pywikibot.exceptions import OtherPageSaveError
+        
+        mock_page = Mock()
+        mock_page.save.side_effect = OtherPageSaveError(Mock(), "Editing restricted by {{nobots}}")
+        
+        with pytest.raises(OtherPageSaveError):
+            save_with_backoff(mock_page, "summary")
+        mock_page.save.assert_called_once()
+        mock_sleep.assert_not_called()
+    
+    @patch('bot_utils.time.sleep')
+    def test_lag_marker_in_title_not_retried(self, mock_sleep):
+        """Test a '429' in the page title is not mistaken for rate limiting."""
+        from pywikibot.exceptions import OtherPageSaveError
+        
+        mock_page = Mock()
+        mock_page.title.return_value = "Category:1429 births"
+        mock_page.save.side_effect = OtherPageSaveError(mock_page, "protectedpage")
+        
+        with pytest.raises(OtherPageSaveError):
+            save_with_backoff(mock_page, "summary")
+        mock_page.save.assert_called_once()
+        mock_sleep.assert_not_called()
@@ -5,104 +5,94 @@ test_category_diffusion_bot.py
 Unit tests for category_diffusion_bot.py with mocked pywikibot API.
 Covers file counting, boundary conditions (199/200/201), error handling.
 
-Run with: pytest test_category_diffusion_bot.py -v
+Run from the repository root with: pytest tests/test_category_diffusion_bot.py -v
 """
 
 import pytest
-import sys
 import os
+import itertools
+import threading
+import time
 from unittest.mock import Mock, MagicMock, patch, call
 
-# Add parent directory to path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-
 from category_diffusion_bot import (
+    compile_parent_tag_regex,
     count_files_in_category,
     get_subcategories,
+    load_state,
+    process_subcategory,
     remove_category_from_parent,
+    save_state,
     DIFFUSION_CATEGORY
 )
 
 
+def mock_members(n=None, taken=None):
+    """
+    Lazily yield n mock category members (endlessly if n is None).
+    
+    Appends to `taken`, if given, for every member actually consumed.
+    """
+    for _ in (itertools.count() if n is None else range(n)):
+        if taken is not None:
+            taken.append(None)
+        yield Mock()
+
+
 class TestFileCounting:
     """Test file counting with various thresholds."""
     
-    def test_count_zero_files(self):
-        """Test category with no files."""
+    def test_count_from_categoryinfo(self):
+        """Test the exact count is read from categoryinfo without walking members."""
         mock_cat = Mock()
-        mock_cat.members.return_value = []
-        mock_cat.title.return_value = "Category:Empty"
+        mock_cat.categoryinfo = {'files': 10000, 'pages': 10003, 'subcats': 3, 'size': 10003}
         
         count = count_files_in_category(mock_cat, 200)
-        assert count == 0
-        mock_cat.members.assert_called_once_with(namespaces=[6], total=201)
+        assert count == 10000
+        mock_cat.members.assert_not_called()
     
-    def test_count_below_threshold(self):
-        """Test category with files below threshold."""
+    def test_count_categoryinfo_without_files(self):
+        """Test categoryinfo without a files entry counts as empty."""
         mock_cat = Mock()
-        mock_files = [Mock() for _ in range(150)]
-        mock_cat.members.return_value = mock_files
-        mock_cat.title.return_value = "Category:Small"
+        mock_cat.categoryinfo = {}
         
-        count = count_files_in_category(mock_cat, 200)
-        assert count == 150
+        assert count_files_in_category(mock_cat, 200) == 0
     
-    def test_count_at_boundary_199(self):
-        """Test boundary condition: 199 files (below 200 threshold)."""
-        mock_cat = Mock()
-        mock_files = [Mock() for _ in range(199)]
-        mock_cat.members.return_value = mock_files
-        mock_cat.title.return_value = "Category:At199"
-        
-        count = count_files_in_category(mock_cat, 200)
-        assert count == 199
+    # Mocks below have no categoryinfo, exercising the member-walk fallback
     
-    def test_count_at_boundary_200(self):
-        """Test boundary condition: 200 files (at threshold)."""
-        mock_cat = Mock()
-        mock_files = [Mock() for _ in range(200)]
-        mock_cat.members.return_value = mock_files
-        mock_cat.title.return_value = "Category:At200"
-        
-        count = count_files_in_category(mock_cat, 200)
-        assert count == 200
-    
-    def test_count_at_boundary_201(self):
-        """Test boundary condition: 201 files (above threshold)."""
-        mock_cat = Mock()
-        mock_files = [Mock() for _ in range(201)]
-        mock_cat.members.return_value = mock_files
-        mock_cat.title.return_value = "Category:At201"
+    @pytest.mark.parametrize('n_files,threshold,expected', [
+        (0, 200, 0),      # empty category
+        (150, 200, 150),  # below threshold
+        (199, 200, 199),  # boundary: below
+        (200, 200, 200),  # boundary: at threshold
+        (201, 200, 201),  # boundary: above
+        (100, 150, 100),  # custom threshold
+    ])
+    def test_count(self, n_files, threshold, expected):
+        """Test counts around the threshold, requesting at most threshold + 1 members."""
+        mock_cat = Mock(spec=['members', 'title'])
+        mock_cat.members.return_value = mock_members(n_files)
+        mock_cat.title.return_value = "Category:Test"
         
-        count = count_files_in_category(mock_cat, 200)
-        assert count == 201
+        assert count_files_in_category(mock_cat, threshold) == expected
+        mock_cat.members.assert_called_once_with(namespaces=[6], total=threshold + 1)
     
     def test_count_short_circuit_large_category(self):
         """Test short-circuit behavior with large category."""
-        mock_cat = Mock()
-        # Simulate 500 files but should stop at 201
-        mock_files = [Mock() for _ in range(500)]
-        mock_cat.members.return_value = iter(mock_files)
+        mock_cat = Mock(spec=['members', 'title'])
+        # Simulate an unbounded category; counting must stop at 201
+        taken = []
+        mock_cat.members.return_value = mock_members(taken=taken)
         mock_cat.title.return_value = "Category:Large"
         
         count = count_files_in_category(mock_cat, 200)
         # Should stop at threshold + 1
         assert count == 201
-    
-    def test_count_custom_threshold_150(self):
-        """Test with custom threshold of 150."""
-        mock_cat = Mock()
-        mock_files = [Mock() for _ in range(100)]
-        mock_cat.members.return_value = mock_files
-        mock_cat.title.return_value = "Category:Custom"
-        
-        count = count_files_in_category(mock_cat, 150)
-        assert count == 100
-        mock_cat.members.assert_called_once_with(namespaces=[6], total=151)
+        assert len(taken) == 201
     
     def test_count_handles_exception(self):
         """Test error handling when counting fails."""
-        mock_cat = Mock()
+        mock_cat = Mock(spec=['members', 'title'])
         mock_cat.members.side_effect = Exception("API Error")
         mock_cat.title.return_value = "Category:Error"
         
@@ -228,6 +218,72 @@ class TestRemoveCategoryFromParent:
         assert result is True
         mock_page.save.assert_called_once()
     
+    @patch('category_diffusion_bot.pywikibot.Page')
+    def test_remove_with_precompiled_tag_regex(self, mock_page_class):
+        """Test removal using a pattern compiled once for the parent."""
+        mock_cat = Mock()
+        mock_cat.title.return_value = "Category:Test"
+        mock_cat.site = Mock()
+        
+        mock_parent = Mock()
+        mock_parent.title.return_value = "Category:Parent"
+        
+        mock_page = Mock()
+        mock_page.get.return_value = "Some text\n[[Category:Parent|SortKey]]\nMore text"
+        mock_page_class.return_value = mock_page
+        
+        tag_re = compile_parent_tag_regex("Category:Parent")
+        result = remove_category_from_parent(
+            mock_cat, mock_parent, dry_run=False, threshold=200, tag_re=tag_re
+        )
+        
+        assert result is True
+        assert mock_page.text == "Some text\n\nMore text"
+    
+    @patch('category_diffusion_bot.pywikibot.Page')
+    def test_remove_passes_basetimestamp(self, mock_page_class):
+        """Test the save is based on the revision that was read."""
+        mock_cat = Mock()
+        mock_cat.title.return_value = "Category:Test"
+        
+        mock_parent = Mock()
+        mock_parent.title.return_value = "Category:Parent"
+        
+        mock_page = Mock()
+        mock_page.get.return_value = "[[Category:Parent]]"
+        mock_page.latest_revision.timestamp = "2024-01-01T00:00:00Z"
+        mock_page_class.return_value = mock_page
+        
+        remove_category_from_parent(mock_cat, mock_parent, dry_run=False, threshold=200)
+        
+        assert mock_page.save.call_args.kwargs['basetimestamp'] == "2024-01-01T00:00:00Z"
+    
+    @patch('category_diffusion_bot.pywikibot.Page')
+    def test_remove_retries_once_on_edit_conflict(self, mock_page_class):
+        """Test an edit conflict re-fetches the page and re-applies the removal."""
+        from pywikibot.exceptions import EditConflictError
+        
+        mock_cat = Mock()
+        mock_cat.title.return_value = "Category:Test"
+        
+        mock_parent = Mock()
+        mock_parent.title.return_value = "Category:Parent"
+        
+        mock_page = Mock()
+        mock_page.get.side_effect = [
+            "Old\n[[Category:Parent]]",
+            "Edited by human\n[[Category:Parent]]",
+        ]
+        mock_page.save.side_effect = [EditConflictError(Mock(), "conflict"), None]
+        mock_page_class.return_value = mock_page
+        
+        result = remove_category_from_parent(mock_cat, mock_parent, dry_run=False, threshold=200)
+        
+        assert result is True
+        assert mock_page.save.call_count == 2
+        mock_page.get.assert_called_with(force=True)
+        assert mock_page.text == "Edited by human\n"
+    
     @patch('category_diffusion_bot.pywikibot.Page')
     def test_remove_handles_no_page_error(self, mock_page_class):
         """Test handling of NoPageError."""
@@ -248,5 +304,71 @@ class TestRemoveCategoryFromParent:
         assert result is False
 
 
-if __name__ == '__main__':
-    pytest.main([__file__, '-v'])
+class TestProcessSubcategory:
+    """Test per-subcategory worker used by the thread pool."""
+    
+    @patch('category_diffusion_bot.remove_category_from_parent')
+    def test_small_category_removed(self, mock_remove):
+        """Test category at threshold is removed from the list."""
+        mock_cat = Mock()
+        mock_cat.title.return_value = "Category:Small"
+        mock_cat.categoryinfo = {'files': 200}
+        mock_remove.return_value = True
+        lock = threading.Semaphore(1)
+        
+        result = process_subcategory(mock_cat, Mock(), True, 200, lock)
+        
+        assert result == ("removed", "Category:Small")
+        mock_remove.assert_called_once()
+        assert mock_remove.call_args.kwargs['save_lock'] is lock
+    
+    @patch('category_diffusion_bot.remove_category_from_parent')
+    def test_large_category_skipped(self, mock_remove):
+        """Test category above threshold is kept without editing."""
+        mock_cat = Mock()
+        mock_cat.title.return_value = "Category:Large"
+        mock_cat.categoryinfo = {'files': 500}
+        
+        result = process_subcategory(mock_cat, Mock(), False, 200, threading.Semaphore(1))
+        
+        assert result == ("skipped", "Category:Large")
+        mock_remove.assert_not_called()
+
+
+class TestStateFile:
+    """Test the --state resume file."""
+    
+    def test_missing_file_is_empty(self, tmp_path):
+        """Test a first run starts with nothing done."""
+        assert load_state(str(tmp_path / "state.json")) == {}
+    
+    def test_round_trip(self, tmp_path):
+        """Test saved outcomes are loaded back and no temp file is left over."""
+        path = str(tmp_path / "state.json")
+        now = time.time()
+        done = {
+            "Category:A": {'outcome': 'removed', 'ts': now},
+            "Category:B": {'outcome': 'skipped', 'ts': now},
+        }
+        save_state(path, done)
+        
+        assert load_state(path) == done
+        assert os.listdir(tmp_path) == ["state.json"]
+    
+    def test_old_entries_expire(self, tmp_path):
+        """Test entries older than max_age are checked again."""
+        path = str(tmp_path / "state.json")
+        now = time.time()
+        save_state(path, {
+            "Category:Old": {'outcome': 'skipped', 'ts': now - 3600},
+            "Category:New": {'outcome': 'skipped', 'ts': now},
+        })
+        
+        assert list(load_state(path, max_age=60)) == ["Category:New"]
+    
+    def test_corrupt_file_is_ignored(self, tmp_path):
+        """Test a damaged state file does not abort the run."""
+        path = tmp_path / "state.json"
+        path.write_text("{not json")
+        
+        assert load_state(str(path)) == {}
@@ -5,25 +5,41 @@ test_replace_templates.py
 Unit tests for replace_templates.py with 24 comprehensive test cases.
 Covers edge cases: multiple templates, custom limits, case variations, redundancy removal.
 
-Run with: pytest test_replace_templates.py -v
+Run from the repository root with: pytest tests/test_replace_templates.py -v
 """
 
-import os
-import sys
+import re
 import pytest
-
-# Add parent directory to path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest.mock import Mock
 
 from replace_templates import (
     normalize_template_name,
     extract_limit_from_template,
     has_target_template,
-    replace_templates
+    replace_templates,
+    build_source_regex,
+    process_category,
+    Outcome
 )
 import config
 
 
+# One sweep finds every target call and any leftover source template name
+_SUMMARY_RE = re.compile(r'(\{\{Diffusion by condition)|(?:CatDiffuse|Cat diffuse|Category diffuse)')
+
+
+def summarize(text):
+    """Return (number of target template calls, whether a source name remains)."""
+    target_count = 0
+    has_source = False
+    for match in _SUMMARY_RE.finditer(text):
+        if match.group(1):
+            target_count += 1
+        else:
+            has_source = True
+    return target_count, has_source
+
+
 class TestNormalizeTemplateName:
     """Test template name normalization (4 tests)."""
     
@@ -86,226 +102,274 @@ class TestTargetTemplateDetection:
         assert has_target_template(text, 'Diffusion by condition') is False
 
 
+# (text, sources, expect_changed, must_contain, must_not_contain)
+REPLACEMENT_CASES = [
+    pytest.param(
+        "{{CatDiffuse}}", ['CatDiffuse'], True,
+        ('{{Diffusion by condition|200}}',), ('CatDiffuse',),
+        id='11-default-limit'),
+    pytest.param(
+        "{{CatDiffuse|150}}", ['CatDiffuse'], True,
+        ('{{Diffusion by condition|150}}',), (),
+        id='12-custom-limit'),
+    pytest.param(
+        "{{catdiffuse}}", ['CatDiffuse'], True,
+        ('{{Diffusion by condition|200}}',), (),
+        id='15-case-insensitive'),
+    pytest.param(
+        "Before text\n{{CatDiffuse}}\nAfter text", ['CatDiffuse'], True,
+        ('Before text', 'After text', '{{Diffusion by condition|200}}'), (),
+        id='17-surrounding-text'),
+    pytest.param(
+        "{{CatDiffuse|limit=175}}", ['CatDiffuse'], True,
+        ('{{Diffusion by condition|175}}',), (),
+        id='18-named-limit'),
+    pytest.param(
+        "{{SomeOtherTemplate}}", ['CatDiffuse'], False,
+        ('{{SomeOtherTemplate}}',), ('Diffusion by condition',),
+        id='19-no-source'),
+    pytest.param(
+        "{{ CatDiffuse | 180 }}", ['CatDiffuse'], True,
+        ('{{Diffusion by condition|180}}',), (),
+        id='20-whitespace'),
+    pytest.param(
+        "{{CatDiffuse|150}} {{Cat diffuse|180}}", ['CatDiffuse', 'Cat diffuse'], True,
+        ('{{Diffusion by condition|150}}',), ('180',),
+        id='21-first-limit-wins'),
+    pytest.param(
+        "\n[[Category:Parent]]\n{{SomeOtherTemplate|param=value}}\n"
+        "{{CatDiffuse|160}}\nMore text here\n{{AnotherTemplate}}\n",
+        ['CatDiffuse'], True,
+        ('{{Diffusion by condition|160}}', '{{SomeOtherTemplate|param=value}}',
+         '{{AnotherTemplate}}'),
+        ('CatDiffuse',),
+        id='23-complex-wikitext'),
+    pytest.param(
+        "", ['CatDiffuse'], False, (), (),
+        id='24-empty-text'),
+]
+
+# Pages that must end up with exactly one target call and no source left
+SINGLE_TARGET_CASES = [
+    pytest.param(
+        "{{CatDiffuse}} some text {{Cat diffuse}}",
+        ['CatDiffuse', 'Cat diffuse'],
+        id='13-replace-first-remove-rest'),
+    pytest.param(
+        "{{Diffusion by condition|200}} {{CatDiffuse}}",
+        ['CatDiffuse'],
+        id='14-target-exists'),
+    pytest.param(
+        "{{CatDiffuse}} text {{Cat diffuse}} more {{Category diffuse}}",
+        ['CatDiffuse', 'Cat diffuse', 'Category diffuse'],
+        id='16-three-variants'),
+    pytest.param(
+        "{{Diffusion by condition|200}} {{CatDiffuse}} {{Cat diffuse}}",
+        ['CatDiffuse', 'Cat diffuse'],
+        id='22-target-and-sources'),
+]
+
+
 class TestTemplateReplacement:
-    """Test template replacement logic (14 tests)."""
-    
-    def test_simple_replacement_default_limit(self):
-        """Test 11: Single template with default limit."""
-        text = "{{CatDiffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
+    """Test template replacement logic (tests 11-24)."""
+
+    @pytest.mark.parametrize(
+        'text, sources, expect_changed, must_contain, must_not_contain',
+        REPLACEMENT_CASES)
+    def test_replacement(self, text, sources, expect_changed,
+                         must_contain, must_not_contain):
+        """Parametrized replacement cases produce the expected text and flags."""
+        new_text, changed, action, limit = replace_templates(
+            text, sources, 'Diffusion by condition', 200
         )
-        assert changed is True
-        assert '{{Diffusion by condition|200}}' in new_text
-        assert 'CatDiffuse' not in new_text
-    
-    def test_preserves_custom_limit(self):
-        """Test 12: Preserve custom limit from source template."""
-        text = "{{CatDiffuse|150}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
+        assert changed is expect_changed
+        if not expect_changed:
+            assert new_text == text
+        assert [f for f in must_contain if f not in new_text] == []
+        assert [f for f in must_not_contain if f in new_text] == []
+
+    @pytest.mark.parametrize('text, sources', SINGLE_TARGET_CASES)
+    def test_leaves_single_target(self, text, sources):
+        """Pages with several templates end up with one target call and no source."""
+        new_text, changed, _, _ = replace_templates(
+            text, sources, 'Diffusion by condition', 200
         )
         assert changed is True
-        assert '{{Diffusion by condition|150}}' in new_text
+        assert summarize(new_text) == (1, False)
+
+    def test_custom_limit_reported(self):
+        """Test 12: The preserved limit is returned and named in the action."""
+        _, _, action, limit = replace_templates(
+            "{{CatDiffuse|150}}", ['CatDiffuse'], 'Diffusion by condition', 200
+        )
         assert '150' in action
-    
-    def test_multiple_templates_replace_first_remove_rest(self):
-        """Test 13: Multiple templates - replace first, remove rest."""
-        text = "{{CatDiffuse}} some text {{Cat diffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse', 'Cat diffuse'],
-            'Diffusion by condition',
-            200
+        assert limit == 150
+
+    def test_target_exists_action(self):
+        """Test 14: Removing sources beside an existing target is reported as such."""
+        new_text, _, action, limit = replace_templates(
+            "{{Diffusion by condition|200}} {{CatDiffuse}}",
+            ['CatDiffuse'], 'Diffusion by condition', 200
         )
-        assert changed is True
         assert '{{Diffusion by condition|200}}' in new_text
-        assert new_text.count('{{Diffusion by condition') == 1
-        assert 'CatDiffuse' not in new_text
-        assert 'Cat diffuse' not in new_text
-    
-    def test_target_exists_removes_source_only(self):
-        """Test 14: When target exists, only remove source templates."""
-        text = "{{Diffusion by condition|200}} {{CatDiffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
-        )
-        assert changed is True
-        assert new_text.count('{{Diffusion by condition|200}}') == 1
-        assert 'CatDiffuse' not in new_text
         assert 'redundant' in action.lower()
-    
-    def test_case_insensitive_matching(self):
-        """Test 15: Case-insensitive template matching."""
-        text = "{{catdiffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
-        )
-        assert changed is True
-        assert '{{Diffusion by condition|200}}' in new_text
-    
-    def test_multiple_variants_same_page(self):
-        """Test 16: Multiple template variants on same page."""
-        text = "{{CatDiffuse}} text {{Cat diffuse}} more {{Category diffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
+        assert limit is None
+
+    def test_duplicates_action(self):
+        """Test 16: Extra source templates are reported as duplicates."""
+        _, _, action, _ = replace_templates(
+            "{{CatDiffuse}} text {{Cat diffuse}} more {{Category diffuse}}",
             ['CatDiffuse', 'Cat diffuse', 'Category diffuse'],
-            'Diffusion by condition',
-            200
+            'Diffusion by condition', 200
         )
-        assert changed is True
-        assert new_text.count('{{Diffusion by condition') == 1
         assert 'duplicate' in action.lower()
+
+
+class TestEdgeCases:
+    """Additional edge case tests."""
     
-    def test_preserves_surrounding_text(self):
-        """Test 17: Preserve text before and after templates."""
-        text = "Before text\n{{CatDiffuse}}\nAfter text"
-        new_text, changed, action = replace_templates(
+    def test_template_at_start_of_text(self):
+        """Ensure template at text start is handled."""
+        text = "{{CatDiffuse}}\nSome text"
+        new_text, changed, _, _ = replace_templates(
             text,
             ['CatDiffuse'],
             'Diffusion by condition',
             200
         )
-        assert 'Before text' in new_text
-        assert 'After text' in new_text
-        assert '{{Diffusion by condition|200}}' in new_text
+        assert changed is True
+        assert new_text.startswith('{{Diffusion by condition|200}}')
     
-    def test_custom_limit_with_named_parameter(self):
-        """Test 18: Custom limit with named parameter."""
-        text = "{{CatDiffuse|limit=175}}"
-        new_text, changed, action = replace_templates(
+    def test_template_at_end_of_text(self):
+        """Ensure template at text end is handled."""
+        text = "Some text\n{{CatDiffuse}}"
+        new_text, changed, _, _ = replace_templates(
             text,
             ['CatDiffuse'],
             'Diffusion by condition',
             200
         )
         assert changed is True
-        assert '{{Diffusion by condition|175}}' in new_text
+        assert new_text.endswith('{{Diffusion by condition|200}}')
     
-    def test_no_source_templates_found(self):
-        """Test 19: No changes when source templates not found."""
-        text = "{{SomeOtherTemplate}}"
-        new_text, changed, action = replace_templates(
+    def test_name_mentioned_without_template_untouched(self):
+        """Ensure a page naming the template in prose is returned as-is, without cleanup."""
+        text = "See  CatDiffuse docs\n\n\n{{Diffusion by condition|200}}"
+        new_text, changed, _, _ = replace_templates(
             text,
             ['CatDiffuse'],
             'Diffusion by condition',
             200
         )
         assert changed is False
-        assert new_text == text
+        assert new_text is text
     
-    def test_whitespace_in_template_syntax(self):
-        """Test 20: Handle templates with extra whitespace."""
-        text = "{{ CatDiffuse | 180 }}"
-        new_text, changed, action = replace_templates(
+    def test_target_after_source_still_detected(self):
+        """Ensure a target later in the page turns the first source into a removal."""
+        text = "{{CatDiffuse|150}}\nText\n{{Diffusion by condition|200}}"
+        new_text, changed, action, limit = replace_templates(
             text,
             ['CatDiffuse'],
             'Diffusion by condition',
             200
         )
         assert changed is True
-        assert '{{Diffusion by condition|180}}' in new_text
+        assert new_text == "\nText\n{{Diffusion by condition|200}}"
+        assert limit is None
     
-    def test_first_template_has_custom_limit(self):
-        """Test 21: Use limit from first template when multiple present."""
-        text = "{{CatDiffuse|150}} {{Cat diffuse|180}}"
-        new_text, changed, action = replace_templates(
+    def test_case_variant_sources_match_once(self):
+        """Ensure names differing only in case don't remove the same span twice."""
+        text = "{{Diffusion by condition|200}}\n{{CatDiffuse}}\nKeep this"
+        new_text, changed, _, _ = replace_templates(
             text,
-            ['CatDiffuse', 'Cat diffuse'],
+            ['CatDiffuse', 'Catdiffuse'],
             'Diffusion by condition',
             200
         )
         assert changed is True
-        assert '{{Diffusion by condition|150}}' in new_text
-        assert '180' not in new_text
+        assert new_text == "{{Diffusion by condition|200}}\n\nKeep this"
     
-    def test_target_and_multiple_sources(self):
-        """Test 22: Target exists with multiple source templates."""
-        text = "{{Diffusion by condition|200}} {{CatDiffuse}} {{Cat diffuse}}"
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse', 'Cat diffuse'],
-            'Diffusion by condition',
-            200
+    def test_text_that_changes_length_when_lowercased(self):
+        """Offsets stay right when lowercasing would lengthen the page."""
+        text = "İstanbul\n{{CatDiffuse|150}}\nMore"
+        new_text, changed, _, limit = replace_templates(
+            text, ['CatDiffuse'], 'Diffusion by condition', 200
         )
         assert changed is True
-        assert new_text.count('{{Diffusion by condition') == 1
-        assert 'CatDiffuse' not in new_text
-        assert 'Cat diffuse' not in new_text
+        assert new_text == "İstanbul\n{{Diffusion by condition|150}}\nMore"
+        assert limit == 150
+
+
+class TestSourceRegex:
+    """Test the combined source-template pattern."""
     
-    def test_complex_wikitext_with_other_templates(self):
-        """Test 23: Handle complex wikitext with other templates."""
-        text = """
-[[Category:Parent]]
-{{SomeOtherTemplate|param=value}}
-{{CatDiffuse|160}}
-More text here
-{{AnotherTemplate}}
-"""
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
-        )
-        assert changed is True
-        assert '{{Diffusion by condition|160}}' in new_text
-        assert '{{SomeOtherTemplate|param=value}}' in new_text
-        assert '{{AnotherTemplate}}' in new_text
-        assert 'CatDiffuse' not in new_text
+    def test_matches_every_alias_in_order(self):
+        """Aliases sharing a prefix are all matched, in page order, as written."""
+        pattern = build_source_regex(['CatDiffuse', 'Cat diffuse', 'Category diffuse'])
+        text = "{{Category diffuse}} {{catdiffuse|150}} {{Cat diffuse}} {{Cat}}"
+        assert [m.group(1) for m in pattern.finditer(text)] == [
+            'Category diffuse', 'catdiffuse', 'Cat diffuse'
+        ]
     
-    def test_empty_text(self):
-        """Test 24: Handle empty text gracefully."""
-        text = ""
-        new_text, changed, action = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
-        )
-        assert changed is False
-        assert new_text == text
+    def test_prefix_name_does_not_match_longer_template(self):
+        """A name that prefixes another template's name only matches itself."""
+        pattern = build_source_regex(['Cat', 'CatDiffuse'])
+        assert [m.group(1) for m in pattern.finditer("{{Cat}} {{CatDiffuseX}}")] == ['Cat']
+    
+    def test_case_sensitive_pattern_matches_lowercased_text(self):
+        """Without ignorecase the pattern is meant for text.lower()."""
+        pattern = build_source_regex(['CatDiffuse'], ignorecase=False)
+        assert pattern.search("{{CatDiffuse}}") is None
+        assert pattern.search("{{catdiffuse}}") is not None
 
 
-class TestEdgeCases:
-    """Additional edge case tests."""
+class TestProcessCategory:
+    """Test per-page outcomes reported to the run summary."""
     
-    def test_template_at_start_of_text(self):
-        """Ensure template at text start is handled."""
-        text = "{{CatDiffuse}}\nSome text"
-        new_text, changed, _ = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
-        )
-        assert changed is True
-        assert new_text.startswith('{{Diffusion by condition|200}}')
+    @staticmethod
+    def _page(text):
+        page = Mock(text=text)
+        page.title.return_value = "Category:Example"
+        return page
     
-    def test_template_at_end_of_text(self):
-        """Ensure template at text end is handled."""
-        text = "Some text\n{{CatDiffuse}}"
-        new_text, changed, _ = replace_templates(
-            text,
-            ['CatDiffuse'],
-            'Diffusion by condition',
-            200
+    def test_unchanged_page(self):
+        """Pages without source templates are counted as unchanged."""
+        page = self._page("No templates here")
+        outcome = process_category(page, ['CatDiffuse'], 'Diffusion by condition', 200, True, False)
+        assert outcome is Outcome.UNCHANGED
+    
+    def test_dry_run_counts_as_updated(self):
+        """Dry-run pages that would change are counted as updated, without saving."""
+        page = self._page("{{CatDiffuse}}")
+        outcome = process_category(page, ['CatDiffuse'], 'Diffusion by condition', 200, True, False)
+        assert outcome is Outcome.UPDATED
+        page.site.editpage.assert_not_called()
+    
+    def test_locked_page_counts_as_failed(self):
+        """Pages that cannot be saved are counted as failed."""
+        from pywikibot.exceptions import LockedPageError
+        page = self._page("{{CatDiffuse}}")
+        page.site.editpage.side_effect = LockedPageError(page)
+        outcome = process_category(page, ['CatDiffuse'], 'Diffusion by condition', 200, False, False)
+        assert outcome is Outcome.FAILED
+    
+    def test_saves_through_site(self):
+        """Edits are submitted with site.editpage using the new text."""
+        page = self._page("{{CatDiffuse|150}}")
+        outcome = process_category(page, ['CatDiffuse'], 'Diffusion by condition', 200, False, False)
+        assert outcome is Outcome.UPDATED
+        page.site.editpage.assert_called_once_with(
+            page,
+            summary=config.EDIT_SUMMARY.format(limit=150),
+            minor=False,
+            bot=True,
+            text='{{Diffusion by condition|150}}'
         )
-        assert changed is True
-        assert new_text.endswith('{{Diffusion by condition|200}}')
-
-
-if __name__ == '__main__':
-    pytest.main([__file__, '-v'])
+    
+    def test_nobots_page_not_edited(self):
+        """Pages opting out with {{nobots}} are skipped and counted as failed."""
+        page = self._page("{{CatDiffuse}}")
+        page.botMayEdit.return_value = False
+        outcome = process_category(page, ['CatDiffuse'], 'Diffusion by condition', 200, False, False)
+        assert outcome is Outcome.FAILED
+        page.site.editpage.assert_not_called()
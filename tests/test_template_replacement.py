@@ -2,15 +2,10 @@
 """
 Unit tests for replace_catdiffuse.py template replacement logic.
 
-Run with: pytest test_template_replacement.py -v
+Run from the repository root with: pytest tests/test_template_replacement.py -v
 """
 
 import pytest
-import sys
-import os
-
-# Add parent directory to path to import the main script
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from replace_catdiffuse import (
     normalize_template_name,
@@ -31,51 +26,61 @@ class TestNormalizeTemplateName:
         assert normalize_template_name('CaTdIfFuSe') == 'catdiffuse'
 
 
+# (text, expect_changed, must_contain, must_not_contain), default threshold 200
+REPLACEMENT_CASES = [
+    pytest.param(
+        "{{CatDiffuse}}", True,
+        ('Diffusion by condition', 'threshold=200'), ('CatDiffuse',),
+        id='simple'),
+    pytest.param(
+        "{{CatDiffuse|param1=value1|param2=value2}}", True,
+        ('Diffusion by condition', 'param1=value1', 'param2=value2',
+         'threshold=200'),
+        (),
+        id='existing-params'),
+    pytest.param(
+        "{{SomeOtherTemplate}}", False,
+        ('{{SomeOtherTemplate}}',), ('Diffusion by condition',),
+        id='not-found'),
+    pytest.param(
+        "{{catdiffuse}}", True,
+        ('Diffusion by condition',), (),
+        id='case-insensitive'),
+    pytest.param(
+        "Header text\n{{CatDiffuse}}\nFooter text", True,
+        ('Header text', 'Footer text', 'Diffusion by condition'), (),
+        id='surrounding-text'),
+    pytest.param(
+        "\n[[Category:Something]]\n{{OtherTemplate|param=value}}\n"
+        "{{CatDiffuse}}\nSome category description.\n[[File:Example.jpg]]\n",
+        True,
+        ('Diffusion by condition', '[[Category:Something]]',
+         '{{OtherTemplate|param=value}}', '[[File:Example.jpg]]'),
+        ('CatDiffuse',),
+        id='complex-wikitext'),
+]
+
+
 class TestFindAndReplaceTemplates:
     """Test template replacement logic."""
-    
-    def test_simple_replacement(self):
-        """Test basic template replacement without parameters."""
-        text = "{{CatDiffuse}}"
-        new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
-            200
-        )
-        assert changed
-        assert 'Diffusion by condition' in new_text
-        assert 'threshold=200' in new_text
-        assert 'CatDiffuse' not in new_text
-        assert detected_threshold is None  # No threshold in original template
-    
-    def test_replacement_with_existing_params(self):
-        """Test replacement preserving existing parameters."""
-        text = "{{CatDiffuse|param1=value1|param2=value2}}"
-        new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
-            200
-        )
-        assert changed
-        assert 'Diffusion by condition' in new_text
-        assert 'param1=value1' in new_text
-        assert 'param2=value2' in new_text
-        assert 'threshold=200' in new_text
-        assert detected_threshold is None
-    
-    def test_no_replacement_when_not_found(self):
-        """Test that text is unchanged when template not found."""
-        text = "{{SomeOtherTemplate}}"
+
+    @pytest.mark.parametrize(
+        'text, expect_changed, must_contain, must_not_contain',
+        REPLACEMENT_CASES)
+    def test_replacement(self, text, expect_changed, must_contain,
+                         must_not_contain):
+        """Parametrized replacement cases produce the expected text and flags."""
         new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
+            text,
+            ['CatDiffuse'],
+            'Diffusion by condition',
             200
         )
-        assert not changed
-        assert new_text == text
+        assert changed is expect_changed
+        if not expect_changed:
+            assert new_text == text
+        assert [f for f in must_contain if f not in new_text] == []
+        assert [f for f in must_not_contain if f in new_text] == []
         assert detected_threshold is None
     
     def test_multiple_templates_in_text(self):
@@ -93,19 +98,6 @@ class TestFindAndReplaceTemplates:
         assert 'CatDiffuse' not in new_text
         assert detected_threshold is None
     
-    def test_case_insensitive_matching(self):
-        """Test that matching is case-insensitive."""
-        text = "{{catdiffuse}}"
-        new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
-            200
-        )
-        assert changed
-        assert 'Diffusion by condition' in new_text
-        assert detected_threshold is None
-    
     def test_multiple_source_templates(self):
         """Test replacing multiple different source templates."""
         text = "{{CatDiffuse}} and {{CatDiffuse2}}"
@@ -120,21 +112,6 @@ class TestFindAndReplaceTemplates:
         assert 'CatDiffuse' not in new_text
         assert detected_threshold is None
     
-    def test_preserve_surrounding_text(self):
-        """Test that surrounding text is preserved."""
-        text = "Header text\n{{CatDiffuse}}\nFooter text"
-        new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
-            200
-        )
-        assert changed
-        assert 'Header text' in new_text
-        assert 'Footer text' in new_text
-        assert 'Diffusion by condition' in new_text
-        assert detected_threshold is None
-    
     def test_threshold_parameter_not_duplicated(self):
         """Test that threshold parameter is not added if already present."""
         text = "{{CatDiffuse|threshold=150}}"
@@ -152,30 +129,6 @@ class TestFindAndReplaceTemplates:
         # Should detect the existing threshold
         assert detected_threshold == 150
     
-    def test_complex_wikitext(self):
-        """Test replacement in complex wikitext with other templates."""
-        text = """
-[[Category:Something]]
-{{OtherTemplate|param=value}}
-{{CatDiffuse}}
-Some category description.
-[[File:Example.jpg]]
-"""
-        new_text, changed, detected_threshold = find_and_replace_templates(
-            text, 
-            ['CatDiffuse'], 
-            'Diffusion by condition', 
-            200
-        )
-        assert changed
-        assert 'Diffusion by condition' in new_text
-        assert 'CatDiffuse' not in new_text
-        # Other content should be preserved
-        assert '[[Category:Something]]' in new_text
-        assert '{{OtherTemplate|param=value}}' in new_text
-        assert '[[File:Example.jpg]]' in new_text
-        assert detected_threshold is None
-    
     def test_custom_threshold_value(self):
         """Test that custom threshold value is correctly applied."""
         text = "{{CatDiffuse}}"
@@ -278,7 +231,47 @@ class TestEdgeCases:
         assert 'param1=value1' in new_text
         assert 'param2=value2' in new_text
         assert detected_threshold == 250
+    
+    def test_mixed_case_threshold_kept_by_parser(self):
+        """Test a Threshold parameter is reused, not duplicated, on the parser path."""
+        text = "<!-- note -->{{CatDiffuse| Threshold = 150 }}"
+        new_text, changed, detected_threshold = find_and_replace_templates(
+            text, 
+            ['CatDiffuse'], 
+            'Diffusion by condition', 
+            200
+        )
+        assert changed
+        assert new_text.lower().count('threshold') == 1
+        assert detected_threshold == 150
 
 
-if __name__ == '__main__':
-    pytest.main([__file__, '-v'])
+class TestFastPath:
+    """Test the regex fast path matches mwparserfromhell output."""
+    
+    @pytest.mark.parametrize('text', [
+        "{{CatDiffuse}}",
+        "{{ Template:catdiffuse |150|a=b c}}",
+        "[[Category:X]]\n{{CatDiffuse|threshold=300}}\n{{Other|{{CatDiffuse|x}}}}",
+        "{{CatDiffuse|threshold=abc|param1=value1}}",
+        "{{CatDiffuse|Threshold=150}}",
+    ])
+    def test_matches_parser_output(self, text, monkeypatch):
+        """Test fast and parser paths produce identical results."""
+        import replace_catdiffuse
+        fast = find_and_replace_templates(text, ['CatDiffuse'], 'Diffusion by condition', 200)
+        monkeypatch.setattr(replace_catdiffuse, '_replace_simple_templates', lambda *args: None)
+        parsed = find_and_replace_templates(text, ['CatDiffuse'], 'Diffusion by condition', 200)
+        assert fast == parsed
+    
+    def test_commented_out_template_untouched(self):
+        """Test templates inside HTML comments are left alone."""
+        text = "<!-- {{CatDiffuse}} -->"
+        new_text, changed, detected_threshold = find_and_replace_templates(
+            text, 
+            ['CatDiffuse'], 
+            'Diffusion by condition', 
+            200
+        )
+        assert not changed
+        assert new_text is text
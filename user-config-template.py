@@ -30,32 +30,54 @@ usernames['commons'] = {'commons': 'YourBotName'}
 # Useful for testing. Set to False for production runs.
 simulate = True
 
-# Should the bot ask for confirmation before making changes?
-# For production runs with approved bots, set to False
-put_throttle = 5  # Minimum seconds to wait between saves
-
-# Maximum number of retries for failed page saves
+# Minimum seconds to wait between saves. Writes are already gated by
+# simulate above, so this only paces real edits:
+#   10 = Pywikibot default / conservative, 5 = moderate, 1 = flagged bot
+# The bots here fetch and rewrite pages on worker threads while a save
+# waits, so this is the floor between saves, not a cost added to every
+# page. Each bot's delay option (--delay, or -delay for
+# category_diffusion_bot.py) overrides it for a single run.
+put_throttle = 5
+
+# Back off when the servers report replication lag above this many seconds.
+# This adapts to load far better than a larger fixed put_throttle. Pywikibot
+# already defaults to 5; to change it, uncomment the line for your version:
+# write_maxlag = 5  # Pywikibot 11.8 and later
+# maxlag = 5        # before Pywikibot 11.8
+
+# Maximum number of retries for failed requests. Pywikibot already waits
+# longer between each retry, so there is no need to raise this blindly.
 max_retries = 3
 
-# Socket timeout (in seconds)
-socket_timeout = 60
+# Socket timeout (in seconds); 30 is plenty for Commons
+socket_timeout = 30
 
-# Enable mwparserfromhell for better template parsing
-use_mwparserfromhell = True
+# Template parsing needs no setting here: replace_templates.py works on the
+# wikitext with regexes only, and replace_catdiffuse.py only hands a page to
+# mwparserfromhell when its regex fast path cannot handle it.
 
 # Logging
-log = ['*']  # Log everything
-logfilename = 'pywikibot.log'
+# Writing every module's log to disk on each API call slows long runs down,
+# so file logging is off by default.
+log = []  # enable specific modules like ['pywikibot'] only when debugging
+# Setting a filename (e.g. 'pywikibot.log') re-enables the file handler
+logfilename = None
 
 # Console output encoding
-console_encoding = 'utf-8'
+# Left unset so Pywikibot uses the terminal's own encoding; only set it
+# (e.g. console_encoding = 'utf-8') if output is garbled on Windows.
 
 # Other useful settings:
 # Enable cosmetic changes (minor formatting fixes)
+# WARNING: setting cosmetic_changes = True re-parses every page it saves
+# even when no content change is needed; leave False unless the run is
+# specifically a cleanup pass.
 cosmetic_changes = False
 
-# Maximum number of pages loaded simultaneously
+# Maximum number of external links weblinkchecker follows per page
+# (unrelated to logging and not used by these bots)
 max_external_links = 50
 
-# Colorize output (for terminal with color support)
-colorized_output = True
+# Colorize output. Left unset, Pywikibot colors only when writing to a
+# terminal, so logs piped to a file (e.g. under cron) carry no ANSI codes.
+# colorized_output = True